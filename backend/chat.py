@@ -0,0 +1,78 @@
+"""
+AI chat proxy to the HuggingFace router API. Light to import: requests is
+loaded by the first chat request.
+"""
+
+import os
+import re
+
+from flask import request, jsonify
+
+HF_API_URL = "https://router.huggingface.co"
+HF_TOKEN = os.getenv("HF_TOKEN") or os.getenv("HF_API_TOKEN") or os.getenv("VITE_HF_API_TOKEN") or ""
+MODEL_NAME = os.getenv("HF_MODEL", "HuggingFaceTB/SmolLM3-3B")
+
+
+def chat():
+    """Proxy chat requests to HuggingFace API"""
+    import requests  # ~100 ms, paid by the first chat request instead of every cold start
+
+    try:
+        data = request.json
+        user_message = data.get("message", "")
+
+        if not user_message:
+            return jsonify({"error": "No message provided"}), 400
+
+        headers = {
+            "Authorization": f"Bearer {HF_TOKEN}",
+            "Content-Type": "application/json",
+        }
+
+        system_prompt = (
+            "Du bist der professionelle KI-Assistent von Pascal Hintermaier. "
+            "Antworte immer auf Deutsch. Gib NIEMALS deine internen Gedankengänge (wie <think>...</think>) in deiner Antwort aus. "
+            "\n\n**Wichtige Hintergrundinformation (Die 'Gastro-to-IT' Story):**\n"
+            "Pascal kommt ursprünglich aus der Gastronomie. Er war 6 Jahre lang im Gastro-Management tätig (u.a. Bar-Chef bei Fluidum UG, Dachgarten engelhorn). "
+            "In dieser Zeit hat er seine Stressresistenz und Problemlösungskompetenz bewiesen. "
+            "Seit 2023 hat er den vollen Wechsel in die IT vollzogen. Er ist also ein Quereinsteiger mit enormer Lernbereitschaft und praktischer Erfahrung in Linux, Python und Automation. "
+            "Er behauptet NICHT, seit 10 Jahren in der Softwareentwicklung zu sein – sein Fokus liegt auf seinem frischen, energiegeladenen Neustart in der Systeminformatik und KI-Automation. "
+            "\n\n**Expertise & Tech Stack:**\n"
+            "- **Frontend:** React 19, TypeScript, Vite 7, Tailwind CSS 4, Framer Motion.\n"
+            "- **Backend & Automation:** Python (OpenCV, Automation Scripts), Java, C#, SQL.\n"
+            "- **Infrastruktur:** Linux (Pop!_OS mastered), Docker, Home-Lab Hosting, AWS.\n"
+            "\n\n**Projekte:**\n"
+            "- 'AI-Powered Portfolio Modernization': Diese Website!\n"
+            "- 'Enhanced Image Comparison Tool': Python/OpenCV Tool zum Bildvergleich.\n"
+            "- 'SmolLM3 Integration': Einbindung lokaler LLMs.\n"
+            "\n\n**Ziele:**\n"
+            "- Abschluss der Ausbildung/Vorbereitung zum IT-Systeminformatiker.\n"
+            "- Kombination von klassischer IT-Infrastruktur mit moderner GenAI-Automation (RAG-Systeme).\n"
+            "- Aufbau von autonomen Workflows und Computer Vision Projekten.\n"
+            f"\n\nKontaktdaten: E-Mail: {os.getenv('CONTACT_EMAIL', 'pascal.hintermaier@example.com')}, "
+            f"GitHub: {os.getenv('CONTACT_GITHUB', 'https://github.com/pascalhintermaier')}, "
+            f"LinkedIn: {os.getenv('CONTACT_LINKEDIN', 'https://linkedin.com/in/pascal-hintermaier')}."
+        )
+
+        payload = {
+            "model": MODEL_NAME,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message},
+            ],
+            "max_tokens": 1000,
+            "temperature": 0.7,
+            "stream": False,
+        }
+
+        response = requests.post(f"{HF_API_URL}/v1/chat/completions", headers=headers, json=payload, timeout=30)
+        if response.status_code == 200:
+            result = response.json()
+            generated_text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+            generated_text = re.sub(r'<think>[\s\S]*?(?:<\/think>|$)', '', generated_text).strip()
+            return jsonify({"response": generated_text})
+        else:
+            return jsonify({"error": f"API error: {response.status_code}", "details": response.text}), response.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
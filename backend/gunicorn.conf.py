@@ -0,0 +1,60 @@
+"""
+Production server configuration for the backend:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app and the modules of its enabled features (OpenCV, NumPy and
+scikit-image for vision) are imported once in the master and shared
+copy-on-write by the forked workers. The backend keeps no state
+between requests, so it scales with one worker per core; the threads keep
+a worker responsive while chat requests wait on the model API. Settings
+come from the environment, see README.md.
+"""
+
+import os
+
+CPU_COUNT = os.cpu_count() or 1
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv("WEB_WORKERS", CPU_COUNT))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+
+# Split the cores between the workers instead of letting every worker size
+# its compare pool and OpenCV for the whole machine (read by app.py at import)
+_share = max(1, CPU_COUNT // workers)
+os.environ.setdefault("COMPARE_THREADS", str(min(5, _share)))
+os.environ.setdefault("OPENCV_THREADS", str(max(1, _share // int(os.environ["COMPARE_THREADS"]))))
+
+preload_app = True
+
+# Covers the 30 s model API timeout of /api/chat
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+# Idle keep-alive connections wait in the gthread poller without holding a
+# thread; behind a load balancer set this above its idle timeout
+keepalive = int(os.getenv("KEEPALIVE", 5))
+
+# Worker heartbeats on tmpfs, a slow disk cannot stall them
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+
+
+def when_ready(server):
+    # Master, after the app is loaded and before the workers are forked;
+    # app.py itself defers the CV stack to the first request
+    import app
+    app.preload()
+
+
+def post_worker_init(worker):
+    # After forking: OpenCV's threads must not exist in the master when it forks
+    import app
+    app.warmup()
+    worker.log.info("Worker %s warmed up", worker.pid)
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
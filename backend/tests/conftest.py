@@ -0,0 +1,9 @@
+"""
+Test setup: make the backend modules importable.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
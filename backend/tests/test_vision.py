@@ -0,0 +1,78 @@
+"""
+Malformed uploads to the vision routes are answered with a JSON 400, not a 500.
+"""
+
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from app import app
+
+ROUTES = ["/api/compare", "/api/template-match"]
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def png_bytes(size=32):
+    img = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def png_base64(size=32):
+    return base64.b64encode(png_bytes(size)).decode()
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("length", ["abc", "1.5", ""])
+def test_non_integer_image1_length(client, route, length):
+    response = client.post(route, data=png_bytes() * 2, content_type="application/octet-stream",
+                           headers={"X-Image1-Length": length})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "X-Image1-Length must be an integer"
+
+
+def test_non_integer_image1_length_query_arg(client):
+    response = client.post("/api/compare?image1_length=half", data=png_bytes() * 2,
+                           content_type="application/octet-stream")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "X-Image1-Length must be an integer"
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("image1", [123, None, ["abc"], {"data": "abc"}])
+def test_non_string_json_image(client, route, image1):
+    response = client.post(route, json={"image1": image1, "image2": png_base64()})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Image data must be a base64 string"
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("image1", ["abc", "data:image/png;base64,abcde", "not base64!"])
+def test_invalid_base64(client, route, image1):
+    response = client.post(route, json={"image1": image1, "image2": png_base64()})
+    assert response.status_code == 400
+    assert response.get_json()["error"] in ("Invalid base64 image data", "Failed to decode images")
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("body", [[1, 2], "image", 3])
+def test_non_object_json_body(client, route, body):
+    response = client.post(route, json=body)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Request body must be a JSON object"
+
+
+def test_valid_uploads(client):
+    images = {"image1": png_base64(64), "image2": png_base64(64)}
+    assert client.post("/api/compare", json=images).status_code == 200
+    images["image2"] = "data:image/png;base64," + png_base64(16)
+    assert client.post("/api/template-match", json=images).status_code == 200
+    body = png_bytes(64) * 2
+    response = client.post("/api/compare", data=body, content_type="application/octet-stream",
+                           headers={"X-Image1-Length": str(len(body) // 2)})
+    assert response.status_code == 200
@@ -0,0 +1,259 @@
+"""
+Image comparison and template matching (OpenCV, scikit-image).
+
+Imported on the first request to a vision route (see app.py), so chat-only
+processes never load the CV stack.
+"""
+
+import base64
+import binascii
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from flask import request, jsonify
+from skimage.metrics import structural_similarity as ssim
+
+from pipeline import Pipeline, Stage
+
+# Compare metrics run in a bounded thread pool; OpenCV's own threads are
+# scaled down so pool threads x OpenCV threads stay close to the core count.
+CPU_COUNT = os.cpu_count() or 1
+COMPARE_THREADS = max(1, int(os.getenv("COMPARE_THREADS", min(5, CPU_COUNT))))
+OPENCV_THREADS = max(1, int(os.getenv("OPENCV_THREADS", CPU_COUNT // COMPARE_THREADS)))
+cv2.setNumThreads(OPENCV_THREADS)
+compare_executor = ThreadPoolExecutor(COMPARE_THREADS, thread_name_prefix="compare") if COMPARE_THREADS > 1 else None
+
+
+# ========================================
+# OpenCV Utility Functions
+# ========================================
+
+class BadRequestError(ValueError):
+    """Raised for malformed uploads; the routes answer these with 400."""
+
+class ImageDecodeError(BadRequestError):
+    """Raised when an uploaded image cannot be decoded."""
+
+def decode_image_bytes(buffer):
+    """Decode raw encoded image bytes to OpenCV image."""
+    img_array = np.frombuffer(buffer, dtype=np.uint8)
+    return cv2.imdecode(img_array, cv2.IMREAD_COLOR) if img_array.size else None
+
+def decode_base64_image(base64_string):
+    """Decode base64 string to OpenCV image."""
+    if not isinstance(base64_string, str): raise ImageDecodeError('Image data must be a base64 string')
+    if 'base64,' in base64_string:
+        base64_string = base64_string.split('base64,')[1]
+    try:
+        buffer = base64.b64decode(base64_string)
+    except binascii.Error:
+        raise ImageDecodeError('Invalid base64 image data')
+    return decode_image_bytes(buffer)
+
+def decode_image(payload):
+    """Decode an upload given either as base64 string (JSON) or raw bytes (binary)."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return decode_image_bytes(payload)
+    return decode_base64_image(payload)
+
+def read_images():
+    """
+    Read image1/image2 from a JSON (base64), multipart/form-data or
+    application/octet-stream body (both files back to back, split at the
+    X-Image1-Length header). Binary bodies are decoded without base64.
+    """
+    if request.mimetype == 'multipart/form-data':
+        images = {name: f.read() for name, f in request.files.items()}
+    elif request.mimetype == 'application/octet-stream':
+        body = memoryview(request.get_data(cache=False))
+        try:
+            split = int(request.headers.get('X-Image1-Length', request.args.get('image1_length', 0)))
+        except ValueError:
+            raise BadRequestError('X-Image1-Length must be an integer')
+        if not 0 < split < len(body): raise BadRequestError('X-Image1-Length must lie inside the request body')
+        images = {'image1': body[:split], 'image2': body[split:]}
+    else:
+        images = request.get_json(silent=True) or {}
+        if not isinstance(images, dict): raise BadRequestError('Request body must be a JSON object')
+    if 'image1' not in images or 'image2' not in images: raise BadRequestError('Both image1 and image2 are required')
+    return images['image1'], images['image2']
+
+def encode_image_base64(img):
+    """Encode OpenCV image to base64 string."""
+    _, buffer = cv2.imencode('.png', img)
+    return base64.b64encode(buffer).decode('utf-8')
+
+def resize_to_match(img1, img2):
+    """Resize images to the same dimensions for comparison."""
+    h1, w1 = img1.shape[:2]
+    h2, w2 = img2.shape[:2]
+    target_h = max(h1, h2)
+    target_w = max(w1, w2)
+    img1_resized = img1 if (h1, w1) == (target_h, target_w) else cv2.resize(img1, (target_w, target_h))
+    img2_resized = img2 if (h2, w2) == (target_h, target_w) else cv2.resize(img2, (target_w, target_h))
+    return img1_resized, img2_resized
+
+def prepare_pair(img1, img2):
+    if img1 is None or img2 is None: raise ImageDecodeError('Failed to decode images')
+    return resize_to_match(img1, img2)
+
+
+# ========================================
+# OpenCV Comparison Algorithms
+# ========================================
+# Stages work on (image1, image2) pairs; compare_pipeline computes each one once per request.
+
+def ssim_stage(gray):
+    score, diff = ssim(gray[0], gray[1], full=True)
+    diff = (diff * 255).astype("uint8")
+    diff_colored = cv2.applyColorMap(255 - diff, cv2.COLORMAP_JET)
+    return score, diff_colored
+
+def feature_stage(pair, features):
+    (kp1, des1), (kp2, des2) = features
+    if des1 is None or des2 is None:
+        return 0, pair[0], {}
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = bf.match(des1, des2)
+    matches = sorted(matches, key=lambda x: x.distance)
+    good_matches = [m for m in matches if m.distance < 50]
+    match_score = len(good_matches) / max(len(kp1), len(kp2)) * 100 if kp1 and kp2 else 0
+    result = cv2.drawMatches(pair[0], kp1, pair[1], kp2, matches[:30], None, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
+    return match_score, result, {'image1_keypoints': len(kp1), 'image2_keypoints': len(kp2), 'total_matches': len(matches), 'good_matches': len(good_matches)}
+
+def histogram_stage(hsv):
+    hist1 = cv2.calcHist([hsv[0]], [0, 1], None, [50, 60], [0, 180, 0, 256])
+    hist2 = cv2.calcHist([hsv[1]], [0, 1], None, [50, 60], [0, 180, 0, 256])
+    cv2.normalize(hist1, hist1, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX)
+    cv2.normalize(hist2, hist2, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX)
+    correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
+    bhattacharyya = cv2.compareHist(hist1, hist2, cv2.HISTCMP_BHATTACHARYYA)
+    return {'correlation': float(correlation), 'bhattacharyya': float(bhattacharyya)}
+
+def edge_stage(edges):
+    edges1, edges2 = edges
+    diff = np.zeros((*edges1.shape, 3), dtype=np.uint8)
+    diff[edges1 > 0] = [0, 255, 0]
+    diff[edges2 > 0] = [0, 0, 255]
+    diff[(edges1 > 0) & (edges2 > 0)] = [255, 255, 255]
+    intersection = np.sum((edges1 > 0) & (edges2 > 0))
+    union = np.sum((edges1 > 0) | (edges2 > 0))
+    similarity = intersection / union if union > 0 else 0
+    return similarity, diff
+
+def pixel_diff_stage(diff_gray):
+    _, thresh = cv2.threshold(diff_gray, 30, 255, cv2.THRESH_BINARY)
+    heatmap = cv2.applyColorMap(diff_gray, cv2.COLORMAP_HOT)
+    total_pixels = diff_gray.shape[0] * diff_gray.shape[1]
+    changed_pixels = np.sum(thresh > 0)
+    return {'difference_percentage': float((changed_pixels / total_pixels) * 100), 'changed_pixels': int(changed_pixels)}, heatmap
+
+def ssim_result(out):
+    score, diff = out
+    return {'score': float(score), 'interpretation': 'identical' if score > 0.95 else 'similar' if score > 0.8 else 'different', 'diff_image': encode_image_base64(diff)}
+
+def features_result(out):
+    score, visualization, stats = out
+    return {'match_score': float(score), 'stats': stats, 'visualization': encode_image_base64(visualization)}
+
+def edges_result(out):
+    similarity, diff = out
+    return {'similarity': float(similarity), 'diff_image': encode_image_base64(diff)}
+
+def pixel_diff_result(out):
+    stats, heatmap = out
+    return {**stats, 'heatmap': encode_image_base64(heatmap)}
+
+compare_pipeline = Pipeline([
+    Stage('img1', decode_image, ['image1']),
+    Stage('img2', decode_image, ['image2']),
+    Stage('resized', prepare_pair, ['img1', 'img2']),
+    Stage('gray', lambda pair: tuple(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for img in pair), ['resized']),
+    Stage('hsv', lambda pair: tuple(cv2.cvtColor(img, cv2.COLOR_BGR2HSV) for img in pair), ['resized']),
+    Stage('blur', lambda gray: tuple(cv2.GaussianBlur(img, (5, 5), 0) for img in gray), ['gray']),
+    Stage('edges', lambda blur: tuple(cv2.Canny(img, 50, 150) for img in blur), ['blur']),
+    Stage('orb', lambda gray: tuple(cv2.ORB_create(nfeatures=500).detectAndCompute(img, None) for img in gray), ['gray']),
+    Stage('diff', lambda pair: cv2.cvtColor(cv2.absdiff(pair[0], pair[1]), cv2.COLOR_BGR2GRAY), ['resized']),
+    Stage('ssim', ssim_stage, ['gray']),
+    Stage('features', feature_stage, ['resized', 'orb']),
+    Stage('histogram', histogram_stage, ['hsv']),
+    Stage('edge_compare', edge_stage, ['edges']),
+    Stage('pixel_diff', pixel_diff_stage, ['diff']),
+    Stage('ssim_result', ssim_result, ['ssim']),
+    Stage('features_result', features_result, ['features']),
+    Stage('edges_result', edges_result, ['edge_compare']),
+    Stage('pixel_diff_result', pixel_diff_result, ['pixel_diff']),
+])
+COMPARE_TARGETS = ['ssim_result', 'features_result', 'histogram', 'edges_result', 'pixel_diff_result']
+
+def template_matching(source_img, template_img):
+    gray_source = cv2.cvtColor(source_img, cv2.COLOR_BGR2GRAY) if len(source_img.shape) == 3 else source_img
+    gray_template = cv2.cvtColor(template_img, cv2.COLOR_BGR2GRAY) if len(template_img.shape) == 3 else template_img
+    sh, sw = gray_source.shape
+    th, tw = gray_template.shape
+    if th > sh or tw > sw:
+        if sh <= th and sw <= tw:
+            source_img, template_img = template_img, source_img
+            gray_source, gray_template = gray_template, gray_source
+            sh, sw, th, tw = th, tw, sh, sw
+        else:
+            return None, None, f"Template ({tw}x{th}) is larger than source ({sw}x{sh})"
+    res = cv2.matchTemplate(gray_source, gray_template, cv2.TM_CCOEFF_NORMED)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+    top_left = max_loc
+    bottom_right = (top_left[0] + tw, top_left[1] + th)
+    result_img = source_img.copy()
+    color = (0, 255, 0) if max_val >= 0.8 else (0, 255, 255) if max_val >= 0.5 else (0, 0, 255)
+    cv2.rectangle(result_img, top_left, bottom_right, color, 3)
+    return {'confidence': float(max_val), 'location': {'x': int(top_left[0]), 'y': int(top_left[1]), 'width': int(tw), 'height': int(th)}}, result_img, None
+
+
+# ========================================
+# Image Compare API
+# ========================================
+
+def compare_images():
+    try:
+        image1, image2 = read_images()
+        results = compare_pipeline.run(COMPARE_TARGETS, executor=compare_executor, image1=image1, image2=image2)
+        return jsonify({
+            'success': True,
+            'results': {
+                'ssim': results['ssim_result'],
+                'features': results['features_result'],
+                'histogram': results['histogram'],
+                'edges': results['edges_result'],
+                'pixel_diff': results['pixel_diff_result']
+            }
+        })
+    except BadRequestError as e: return jsonify({'error': str(e)}), 400
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
+def template_match():
+    try:
+        image1, image2 = read_images()
+        source = decode_image(image1)
+        template = decode_image(image2)
+        if source is None or template is None: raise ImageDecodeError('Failed to decode images')
+        stats, result_img, error = template_matching(source, template)
+        if error: return jsonify({'success': False, 'error': error}), 400
+        return jsonify({'success': True, 'results': {'match': stats, 'visualization': encode_image_base64(result_img)}})
+    except BadRequestError as e: return jsonify({'error': str(e)}), 400
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
+
+# ========================================
+# Server Lifecycle
+# ========================================
+
+def warmup():
+    """Run one small comparison so the first request skips OpenCV's lazy initialization."""
+    img = np.random.default_rng(0).integers(0, 256, (128, 128, 3), dtype=np.uint8)
+    image1, image2 = (cv2.imencode('.png', i)[1].tobytes() for i in (img, np.roll(img, 8, axis=1)))
+    compare_pipeline.run(COMPARE_TARGETS, executor=compare_executor, image1=image1, image2=image2)
+
+def shutdown():
+    if compare_executor is not None:
+        compare_executor.shutdown()
@@ -10,242 +10,623 @@ A Flask REST API demonstrating OpenCV image processing skills:
 - Edge Detection (Canny)
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, make_response, stream_with_context
 from flask_cors import CORS
 import cv2
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
 import base64
+import binascii
 import io
+import json
 from PIL import Image
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from batch import BATCH_METRICS, DEFAULT_BATCH_METRICS, baseline_scores, common_size, compare_baseline, compare_matrix, matrix_scores
+from cache import ArtifactStore, ImageCache, ResultCache, digest
+import compare
+from compare import DEFAULT_METRICS, METRICS, VISUALIZATION_BYTES, VISUALIZATIONS, compare_stages
+from errors import BadRequestError, ImageDecodeError
+from feature_index import FeatureIndex, FeatureStore
+from histogram_index import HIST_METRICS, HistogramIndex
+from jobs import JOB_KINDS, JobManager, JobQueueFull
+from matching import ENGINES, SEARCH_MODES, PreparedSource, match_all, match_sweep, match_template
+from perceptual_hash import HASH_KINDS, MAX_DISTANCE, HashIndex, hamming, hash_hex, image_hashes
+from pipeline import Pipeline, Stage, iter_completed
+from ssim import SSIM_WINDOWS
+from tiled import DEFAULT_TILE_SIZE
+from workers import ComputePool
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend communication
 
+# ========================================
+# Concurrency
+# ========================================
+# The metrics of one /api/compare request run concurrently in a bounded
+# thread pool (OpenCV and most NumPy calls release the GIL). OpenCV also
+# parallelizes internally, so its thread count is scaled down to keep
+# pool threads x OpenCV threads close to the number of cores.
+
+CPU_COUNT = os.cpu_count() or 1
+COMPARE_THREADS = max(1, int(os.getenv('COMPARE_THREADS', min(5, CPU_COUNT))))
+OPENCV_THREADS = max(1, int(os.getenv('OPENCV_THREADS', CPU_COUNT // COMPARE_THREADS)))
+cv2.setNumThreads(OPENCV_THREADS)
+
+# None = run stages sequentially on the request thread
+compare_executor = ThreadPoolExecutor(COMPARE_THREADS, thread_name_prefix='compare') if COMPARE_THREADS > 1 else None
+
+# Optional compute processes for /api/compare. The GIL serializes the
+# Python parts of concurrent comparisons; with COMPUTE_PROCESSES > 0 each
+# comparison runs its stage graph in one of these processes instead (one
+# OpenCV thread each), with the decoded images and the visualizations
+# passed through shared memory. Under gunicorn the processes only import
+# compare.py. The development server runs this file as __main__, which
+# spawned processes (these and the job workers) re-import as __mp_main__,
+# so the setup below must stay cheap and safe to repeat: pools and threads
+# start on first use and the feature store only reads its files on load.
+# 0 = off, everything runs in this process.
+COMPUTE_PROCESSES = max(0, int(os.getenv('COMPUTE_PROCESSES', 0)))
+compute_pool = ComputePool(COMPUTE_PROCESSES, ['compare']) if COMPUTE_PROCESSES else None
+
+# ========================================
+# Caches
+# ========================================
+# Finished responses keyed on image content + endpoint + parameters.
+
+RESULT_CACHE_MB = int(os.getenv('RESULT_CACHE_MB', 256))
+result_cache = ResultCache(RESULT_CACHE_MB * 1024 * 1024)
+
+# Decoded images (+ gray/HSV) keyed on the raw bytes, shared across requests.
+IMAGE_CACHE_MB = int(os.getenv('IMAGE_CACHE_MB', 256))
+image_cache = ImageCache(IMAGE_CACHE_MB * 1024 * 1024)
+
+# Encoded visualizations served from /api/artifacts (image_output=url)
+ARTIFACT_CACHE_MB = int(os.getenv('ARTIFACT_CACHE_MB', 128))
+ARTIFACT_TTL = int(os.getenv('ARTIFACT_TTL', 300))
+artifact_store = ArtifactStore(ARTIFACT_CACHE_MB * 1024 * 1024, ARTIFACT_TTL)
+
+# ========================================
+# Tiled Execution
+# ========================================
+# Images above TILED_MIN_PIXELS run SSIM and pixel difference tile by tile,
+# so float working memory is bounded by the tile size, not the image size.
+
+TILED_MIN_PIXELS = int(os.getenv('TILED_MIN_PIXELS', 16_000_000))
+TILE_SIZE = int(os.getenv('TILE_SIZE', DEFAULT_TILE_SIZE))
+TILING = (TILE_SIZE, TILED_MIN_PIXELS)
+
+# ========================================
+# Batch Comparison
+# ========================================
+# Upper bound for the number of images in one /api/compare/batch request
+# (a full matrix of N images compares N * (N - 1) / 2 pairs)
+
+MAX_BATCH_IMAGES = int(os.getenv('MAX_BATCH_IMAGES', 100))
+
+# Memory for the per-image SSIM terms reused across pairs; larger batches
+# compute SSIM pair by pair
+BATCH_MOMENTS_MB = int(os.getenv('BATCH_MOMENTS_MB', 512))
+
+# ========================================
+# Background Jobs
+# ========================================
+# Long comparisons submitted to /api/jobs run in worker processes (lower
+# priority, one OpenCV thread each), separate from the request threads and
+# compare_executor, so they cannot stall interactive requests.
+
+JOB_WORKERS = max(1, int(os.getenv('JOB_WORKERS', max(1, CPU_COUNT // 2))))
+JOB_QUEUE = int(os.getenv('JOB_QUEUE', 16))
+JOB_TTL = int(os.getenv('JOB_TTL', 3600))
+job_manager = JobManager(JOB_WORKERS, JOB_QUEUE, JOB_TTL)
+
+# ========================================
+# Template Matching
+# ========================================
+# Upper bound for the number of templates in one batch request
+
+MAX_BATCH_TEMPLATES = int(os.getenv('MAX_BATCH_TEMPLATES', 100))
+
+# Upper bound for scales x angles of one scale/rotation sweep
+MAX_SWEEP_CANDIDATES = 64
+
+# ========================================
+# Reference Corpus
+# ========================================
+# ORB features of registered reference images, persisted on disk so
+# /api/features/query can identify an image among thousands of references.
+
+FEATURE_INDEX_DIR = os.getenv(
+    'FEATURE_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'features')
+)
+feature_index = FeatureIndex(FeatureStore(FEATURE_INDEX_DIR))
+
+# Perceptual hashes of registered references (in memory) for
+# near-duplicate lookups via /api/hash/query
+hash_index = HashIndex()
+
+# H-S color histograms of registered references (in memory) for
+# color-based retrieval via /api/histogram/query
+histogram_index = HistogramIndex()
+
 # ========================================
 # Utility Functions
 # ========================================
 
-def decode_base64_image(base64_string):
-    """Decode base64 string to OpenCV image."""
+def decode_image_bytes(buffer):
+    """Decode raw encoded image bytes (PNG, JPEG, ...) to OpenCV image."""
+    img_array = np.frombuffer(buffer, dtype=np.uint8)
+    if img_array.size == 0:
+        return None
+    return cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+
+def decode_base64_bytes(base64_string):
+    """Decode base64 string (optionally a data URL) to the raw image bytes."""
+    if not isinstance(base64_string, str):
+        raise ImageDecodeError('Image data must be a base64 string')
+
     # Remove data URL prefix if present
     if 'base64,' in base64_string:
         base64_string = base64_string.split('base64,')[1]
-    
-    img_bytes = base64.b64decode(base64_string)
-    img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-    return img
 
-def encode_image_base64(img):
+    try:
+        return base64.b64decode(base64_string)
+    except (binascii.Error, TypeError):
+        raise ImageDecodeError('Invalid base64 image data')
+
+def decode_base64_image(base64_string):
+    """Decode base64 string to OpenCV image."""
+    return decode_image_bytes(decode_base64_bytes(base64_string))
+
+def decode_image(payload):
+    """
+    Decode an upload given either as base64 string (JSON) or raw bytes (binary).
+    Goes through image_cache, so the returned array is shared and read-only.
+    """
+    if isinstance(payload, str):
+        payload = decode_base64_bytes(payload)
+    return image_cache.decode(payload, decode_image_bytes)
+
+def _parse_option(value):
+    """Form fields and query args arrive as strings; accept JSON literals there."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+# Request fields holding a list of images
+IMAGE_LISTS = ('templates', 'images')
+
+def read_image_request():
+    """
+    Read image1/image2 and request options from the current request.
+
+    Supported bodies:
+    - application/json: base64 strings (optionally data URLs) in image1/image2,
+      converted to raw bytes here so every body type yields the same payloads
+    - multipart/form-data: files image1/image2, options as form fields
+    - application/octet-stream: image1 bytes directly followed by image2 bytes;
+      the X-Image1-Length header (or ?image1_length=) marks the split
+
+    Binary bodies skip the base64 round trip and are decoded straight from
+    the request buffer. Returns (images, options) with raw image bytes.
+
+    The batch endpoints additionally read the `templates` / `images` lists
+    (repeated multipart files or JSON arrays of base64 strings), returned
+    as images['templates'] / images['images'].
+    """
+    mimetype = request.mimetype
+
+    if mimetype == 'multipart/form-data':
+        images = {name: f.read() for name, f in request.files.items() if name in ('image1', 'image2')}
+        for name in IMAGE_LISTS:
+            if name in request.files:
+                images[name] = [f.read() for f in request.files.getlist(name)]
+        options = {key: _parse_option(value) for key, value in request.form.items()}
+    elif mimetype == 'application/octet-stream':
+        body = memoryview(request.get_data(cache=False))
+        split = request.headers.get('X-Image1-Length', request.args.get('image1_length'))
+        if split is None:
+            raise BadRequestError('X-Image1-Length header is required for application/octet-stream bodies')
+        try:
+            split = int(split)
+        except ValueError:
+            raise BadRequestError('X-Image1-Length must be an integer')
+        if not 0 < split < len(body):
+            raise BadRequestError('X-Image1-Length must lie inside the request body')
+        images = {'image1': body[:split], 'image2': body[split:]}
+        options = {}
+    else:
+        options = request.get_json(silent=True)
+        if not isinstance(options, dict):
+            raise BadRequestError('Request body must be JSON, multipart/form-data or application/octet-stream')
+        images = {name: decode_base64_bytes(options.pop(name)) for name in ('image1', 'image2') if name in options}
+        for name in IMAGE_LISTS:
+            if name in options:
+                items = options.pop(name)
+                if not isinstance(items, list):
+                    raise BadRequestError(f'{name} must be a list of base64 images')
+                images[name] = [decode_base64_bytes(item) for item in items]
+
+    # Query args work as options for every body type
+    for key, value in request.args.items():
+        if key != 'image1_length':
+            options.setdefault(key, _parse_option(value))
+
+    return images, options
+
+def read_image_list(field):
+    """
+    Read a list of named images and the request options for the corpus
+    endpoints:
+    - multipart/form-data: repeated files `field`, named by their filenames
+    - application/json: `field` as an array of base64 strings or
+      {"name": ..., "image": ...} objects
+    Returns ([(name, raw bytes), ...], options).
+    """
+    if request.mimetype == 'multipart/form-data':
+        items = [(f.filename or str(index), f.read()) for index, f in enumerate(request.files.getlist(field))]
+        options = {key: _parse_option(value) for key, value in request.form.items()}
+    else:
+        options = request.get_json(silent=True)
+        if not isinstance(options, dict):
+            raise BadRequestError('Request body must be JSON or multipart/form-data')
+        entries = options.pop(field, [])
+        if not isinstance(entries, list):
+            raise BadRequestError(f'{field} must be a list of images')
+        items = []
+        for index, entry in enumerate(entries):
+            if isinstance(entry, dict):
+                items.append((str(entry.get('name', index)), decode_base64_bytes(entry.get('image', ''))))
+            else:
+                items.append((str(index), decode_base64_bytes(entry)))
+
+    for key, value in request.args.items():
+        options.setdefault(key, _parse_option(value))
+    return items, options
+
+# Output format -> (file extension, quality flag)
+IMAGE_FORMATS = {
+    'png': ('.png', None),
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY)
+}
+
+IMAGE_MIMETYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# How images are returned: base64 in the JSON body or as artifact URLs
+IMAGE_OUTPUTS = ('inline', 'url')
+
+# Request options that control how visualizations are encoded
+ENCODE_PARAMS = ('image_format', 'image_quality', 'png_compression', 'max_image_dim', 'image_output')
+
+def _int_option(options, name, default, low, high):
+    value = options.get(name, default)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise BadRequestError(f'{name} must be an integer between {low} and {high}')
+    return value
+
+def encode_options(options):
+    """
+    Validate the visualization output options of a request:
+    - image_format: png (default), jpeg or webp
+    - image_quality: 1-100 for jpeg/webp (default 90)
+    - png_compression: zlib level 0-9 for png (default: OpenCV's fast setting)
+    - max_image_dim: downscale so the longer side is at most this many pixels
+    - image_output: inline (base64, default) or url (/api/artifacts/<id>)
+    """
+    image_format = options.get('image_format', 'png')
+    if image_format not in IMAGE_FORMATS:
+        raise BadRequestError(f"Unknown image_format '{image_format}'. Choose from {', '.join(IMAGE_FORMATS)}")
+    image_output = options.get('image_output', 'inline')
+    if image_output not in IMAGE_OUTPUTS:
+        raise BadRequestError(f"Unknown image_output '{image_output}'. Choose from {', '.join(IMAGE_OUTPUTS)}")
+    return {
+        'format': image_format,
+        'output': image_output,
+        'quality': _int_option(options, 'image_quality', 90, 1, 100),
+        'compression': _int_option(options, 'png_compression', None, 0, 9),
+        'max_dim': _int_option(options, 'max_image_dim', None, 16, 65535)
+    }
+
+def encode_image(img, options=None):
+    """Encode OpenCV image to PNG (default), JPEG or WebP bytes."""
+    if options is None:
+        _, buffer = cv2.imencode('.png', img)
+        return buffer
+
+    # Shrinking first is the cheapest way to cut encode time and size
+    max_dim = options['max_dim']
+    h, w = img.shape[:2]
+    if max_dim and max(h, w) > max_dim:
+        scale = max_dim / max(h, w)
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    extension, quality_flag = IMAGE_FORMATS[options['format']]
+    if quality_flag is None:
+        params = [] if options['compression'] is None else [cv2.IMWRITE_PNG_COMPRESSION, options['compression']]
+    else:
+        params = [quality_flag, options['quality']]
+    _, buffer = cv2.imencode(extension, img, params)
+    return buffer
+
+def encode_image_base64(img, options=None):
     """Encode OpenCV image to base64 string."""
-    _, buffer = cv2.imencode('.png', img)
-    return base64.b64encode(buffer).decode('utf-8')
+    return base64.b64encode(encode_image(img, options)).decode('utf-8')
 
-def resize_to_match(img1, img2):
-    """Resize images to the same dimensions for comparison."""
-    h1, w1 = img1.shape[:2]
-    h2, w2 = img2.shape[:2]
-    
-    # Use the larger dimensions
-    target_h = max(h1, h2)
-    target_w = max(w1, w2)
-    
-    img1_resized = cv2.resize(img1, (target_w, target_h))
-    img2_resized = cv2.resize(img2, (target_w, target_h))
-    
-    return img1_resized, img2_resized
+def image_payload(img, options):
+    """
+    Encode an image for a JSON response: a base64 string, or with
+    image_output=url the path of an artifact served by /api/artifacts.
+    """
+    if options['output'] == 'inline':
+        return encode_image_base64(img, options)
+    buffer = encode_image(img, options)
+    artifact_id = artifact_store.put_artifact(buffer, IMAGE_MIMETYPES[options['format']])
+    return f"/api/artifacts/{artifact_id}{IMAGE_FORMATS[options['format']][0]}"
 
 # ========================================
-# OpenCV Comparison Algorithms
+# Cached Conversions
 # ========================================
+# Gray and HSV versions of images from image_cache are computed once and
+# kept with the decoded image, across requests and endpoints.
 
-def calculate_ssim(img1, img2):
+def gray_image(img):
+    """Grayscale version of a BGR image, cached for images from image_cache."""
+    return image_cache.derive(img, 'gray', lambda bgr: cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+
+def prepared_source(img):
     """
-    Calculate Structural Similarity Index (SSIM).
-    SSIM measures perceived quality and structural information.
-    Returns a score from -1 to 1, where 1 means identical.
+    Template search data (gray, pyramid, DFT spectrum, integrals) of a BGR
+    image, cached for images from image_cache so repeated requests against
+    the same source reuse its spectrum.
     """
-    img1_resized, img2_resized = resize_to_match(img1, img2)
-    
-    # Convert to grayscale
-    gray1 = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate SSIM
-    score, diff = ssim(gray1, gray2, full=True)
-    
-    # Convert diff to displayable image
-    diff = (diff * 255).astype("uint8")
-    
-    # Create a colored diff visualization
-    diff_colored = cv2.applyColorMap(255 - diff, cv2.COLORMAP_JET)
-    
-    return score, diff_colored
+    return image_cache.derive(
+        img, 'prepared', lambda image: PreparedSource(gray_image(image) if len(image.shape) == 3 else image)
+    )
 
-def feature_matching(img1, img2):
+def hsv_image(img):
+    """HSV version of a BGR image, cached for images from image_cache."""
+    return image_cache.derive(img, 'hsv', lambda bgr: cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV))
+
+def to_gray(pair):
+    """Convert both images to grayscale."""
+    return tuple(gray_image(img) for img in pair)
+
+def to_hsv(pair):
+    """Convert both images to HSV for better color representation."""
+    return tuple(hsv_image(img) for img in pair)
+
+# ========================================
+# Comparison Pipeline
+# ========================================
+# The stages themselves live in compare.py, which the compute processes
+# import (see COMPUTE_PROCESSES); this process adds decoding, cached
+# conversions and encoding (the artifact store lives here).
+
+compare_pipeline = Pipeline([
+    # Decoding
+    Stage('img1', decode_image, ['image1']),
+    Stage('img2', decode_image, ['image2']),
+    # Preprocessing, metrics, visualizations and result sections
+    *compare_stages(TILING, to_gray, to_hsv),
+    # Encoding
+    *(Stage(f'{name}_encoded', image_payload, [name, 'encode_options']) for name in VISUALIZATIONS),
+])
+
+def effective_tile_size(shape, tile_size):
+    """Resolve the `tile_size` option ('auto', 0 = off, or pixels) for an image shape."""
+    return compare.effective_tile_size(shape, tile_size, TILING)
+
+def run_compare(images, metrics, visualize, stage_options, output):
     """
-    Feature detection and matching using ORB (Oriented FAST and Rotated BRIEF).
-    ORB is a fast and efficient alternative to SIFT/SURF.
+    Run the comparison stages for `metrics` and `visualize` and return the
+    pipeline results (metric sections and encoded visualizations).
+
+    With compute_pool the images are decoded here (through image_cache),
+    compared in a compute process and the returned visualizations are
+    encoded here, where the artifact store lives.
     """
-    img1_resized, img2_resized = resize_to_match(img1, img2)
-    
-    # Convert to grayscale
-    gray1 = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2GRAY)
-    
-    # Initialize ORB detector
-    orb = cv2.ORB_create(nfeatures=500)
-    
-    # Find keypoints and descriptors
-    kp1, des1 = orb.detectAndCompute(gray1, None)
-    kp2, des2 = orb.detectAndCompute(gray2, None)
-    
-    # Handle case where no features found
-    if des1 is None or des2 is None:
-        return 0, img1_resized, []
-    
-    # Create BFMatcher
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-    
-    # Match descriptors
-    matches = bf.match(des1, des2)
-    
-    # Sort by distance
-    matches = sorted(matches, key=lambda x: x.distance)
-    
-    # Calculate match score (percentage of good matches)
-    good_matches = [m for m in matches if m.distance < 50]
-    match_score = len(good_matches) / max(len(kp1), len(kp2)) * 100 if kp1 and kp2 else 0
-    
-    # Draw matches
-    result = cv2.drawMatches(
-        img1_resized, kp1, 
-        img2_resized, kp2, 
-        matches[:30],  # Show top 30 matches
-        None, 
-        flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS
+    targets = [METRICS[name] for name in metrics]
+    if compute_pool is None:
+        return compare_pipeline.run(
+            targets + [f'{name}_encoded' for name in visualize],
+            executor=compare_executor,
+            image1=images['image1'],
+            image2=images['image2'],
+            encode_options=output,
+            **stage_options
+        )
+
+    img1, img2 = decode_image(images['image1']), decode_image(images['image2'])
+    if img1 is None or img2 is None:
+        raise ImageDecodeError('Failed to decode images')
+    pixels = max(img1.shape[0], img2.shape[0]) * max(img1.shape[1], img2.shape[1])
+    results, rendered = compute_pool.run(
+        'compare',
+        {'img1': img1, 'img2': img2},
+        {name: VISUALIZATION_BYTES[name] * pixels for name in visualize},
+        targets, visualize, stage_options, TILING
     )
-    
-    return match_score, result, {
-        'image1_keypoints': len(kp1),
-        'image2_keypoints': len(kp2),
-        'total_matches': len(matches),
-        'good_matches': len(good_matches)
-    }
+    for name, img in rendered.items():
+        results[f'{name}_encoded'] = image_payload(img, output)
+    return results
 
-def histogram_comparison(img1, img2):
+def _select(value, choices, option, default=None):
+    """Parse a list option given as list, comma separated string or bool."""
+    if value is None and default is not None:
+        return list(default)
+    if value is None or value is True:
+        return list(choices)
+    if value is False:
+        return []
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+    unknown = [item for item in value if item not in choices]
+    if unknown:
+        raise BadRequestError(f"Unknown {option}: {', '.join(map(str, unknown))}. Choose from {', '.join(choices)}")
+    return [item for item in choices if item in value]
+
+def compare_targets(options):
     """
-    Compare images using color histogram correlation.
-    Uses HSV color space for better color representation.
+    Resolve the `metrics` and `visualize` request options into
+    (metrics, visualizations); run_compare() maps them to pipeline targets.
+
+    Omitted options select the original five metrics and all their images.
+    Visualizations of metrics that were not requested are skipped.
     """
-    img1_resized, img2_resized = resize_to_match(img1, img2)
-    
-    # Convert to HSV
-    hsv1 = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2HSV)
-    hsv2 = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2HSV)
-    
-    # Calculate histograms
-    hist1 = cv2.calcHist([hsv1], [0, 1], None, [50, 60], [0, 180, 0, 256])
-    hist2 = cv2.calcHist([hsv2], [0, 1], None, [50, 60], [0, 180, 0, 256])
-    
-    # Normalize histograms
-    cv2.normalize(hist1, hist1, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX)
-    cv2.normalize(hist2, hist2, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX)
-    
-    # Compare using different methods
-    correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
-    chi_square = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CHISQR)
-    intersection = cv2.compareHist(hist1, hist2, cv2.HISTCMP_INTERSECT)
-    bhattacharyya = cv2.compareHist(hist1, hist2, cv2.HISTCMP_BHATTACHARYYA)
-    
-    return {
-        'correlation': float(correlation),  # 1 = identical, -1 = opposite
-        'chi_square': float(chi_square),    # 0 = identical, higher = different
-        'intersection': float(intersection),
-        'bhattacharyya': float(bhattacharyya)  # 0 = identical, 1 = completely different
-    }
+    metrics = _select(options.get('metrics'), list(METRICS), 'metrics', DEFAULT_METRICS)
+    visualize = _select(options.get('visualize'), list(VISUALIZATIONS), 'visualizations')
+    visualize = [name for name in visualize if VISUALIZATIONS[name][0] in metrics]
+    return metrics, visualize
 
-def edge_detection_compare(img1, img2, low_threshold=50, high_threshold=150):
+def tile_size_option(options):
+    """Validate the optional `tile_size` request option ('auto', 0 = off, or pixels)."""
+    tile_size = options.get('tile_size', 'auto')
+    if tile_size == 'auto':
+        return tile_size
+    if not isinstance(tile_size, int) or isinstance(tile_size, bool) or tile_size < 0 or 0 < tile_size < 64:
+        raise BadRequestError("tile_size must be 'auto', 0 (off) or at least 64 pixels")
+    return tile_size
+
+def ssim_window_option(options):
+    """Validate the optional `ssim_window` request option."""
+    window = options.get('ssim_window', 'box')
+    if window not in SSIM_WINDOWS:
+        raise BadRequestError(f"Unknown ssim_window '{window}'. Choose from {', '.join(SSIM_WINDOWS)}")
+    return window
+
+def search_option(options):
+    """Validate the optional template matching `search` request option."""
+    search = options.get('search', 'exhaustive')
+    if search not in SEARCH_MODES:
+        raise BadRequestError(f"Unknown search '{search}'. Choose from {', '.join(SEARCH_MODES)}")
+    return search
+
+def engine_option(options):
+    """Validate the optional template matching `engine` request option."""
+    engine = options.get('engine', 'auto')
+    if engine not in ENGINES:
+        raise BadRequestError(f"Unknown engine '{engine}'. Choose from {', '.join(ENGINES)}")
+    return engine
+
+def multi_match_option(options):
     """
-    Compare images using Canny edge detection.
-    Useful for detecting structural changes.
+    Validate `min_confidence` / `max_results`. Returns None (single best
+    match) or (min_confidence, max_results) for multi-instance matching.
     """
-    img1_resized, img2_resized = resize_to_match(img1, img2)
-    
-    # Convert to grayscale
-    gray1 = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2GRAY)
-    
-    # Apply Gaussian blur to reduce noise
-    blur1 = cv2.GaussianBlur(gray1, (5, 5), 0)
-    blur2 = cv2.GaussianBlur(gray2, (5, 5), 0)
-    
-    # Canny edge detection
-    edges1 = cv2.Canny(blur1, low_threshold, high_threshold)
-    edges2 = cv2.Canny(blur2, low_threshold, high_threshold)
-    
-    # Create difference visualization
-    # Green = edges only in img1, Red = edges only in img2, White = common
-    diff = np.zeros((*edges1.shape, 3), dtype=np.uint8)
-    diff[edges1 > 0] = [0, 255, 0]  # Green for image 1
-    diff[edges2 > 0] = [0, 0, 255]  # Red for image 2
-    diff[(edges1 > 0) & (edges2 > 0)] = [255, 255, 255]  # White for both
-    
-    # Calculate edge similarity
-    intersection = np.sum((edges1 > 0) & (edges2 > 0))
-    union = np.sum((edges1 > 0) | (edges2 > 0))
-    similarity = intersection / union if union > 0 else 0
-    
-    return similarity, edges1, edges2, diff
+    min_confidence = options.get('min_confidence')
+    max_results = options.get('max_results', 100)
+    if min_confidence is None:
+        return None
+    if not isinstance(min_confidence, (int, float)) or isinstance(min_confidence, bool) or not -1 <= min_confidence <= 1:
+        raise BadRequestError('min_confidence must be a number between -1 and 1')
+    if not isinstance(max_results, int) or isinstance(max_results, bool) or not 1 <= max_results <= 1000:
+        raise BadRequestError('max_results must be an integer between 1 and 1000')
+    return float(min_confidence), max_results
+
+def _number_list(value, option):
+    """Parse a list of numbers given as list, single number or comma separated string."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [float(value)]
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+    try:
+        return [float(item) for item in value]
+    except (TypeError, ValueError):
+        raise BadRequestError(f'{option} must be a list of numbers')
 
-def absolute_difference(img1, img2, threshold=30):
+def sweep_option(options):
     """
-    Calculate absolute pixel difference between images.
-    Returns a heatmap showing differences.
+    Validate `scales` / `angles` / `stop_confidence`. Returns None (no sweep)
+    or (scales, angles, stop_confidence) for a scale/rotation sweep.
     """
-    img1_resized, img2_resized = resize_to_match(img1, img2)
-    
-    # Calculate absolute difference
-    diff = cv2.absdiff(img1_resized, img2_resized)
-    
-    # Convert to grayscale for analysis
-    diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-    
-    # Apply threshold to highlight significant differences
-    _, thresh = cv2.threshold(diff_gray, threshold, 255, cv2.THRESH_BINARY)
-    
-    # Create colored heatmap
-    heatmap = cv2.applyColorMap(diff_gray, cv2.COLORMAP_HOT)
-    
-    # Calculate statistics
-    total_pixels = diff_gray.shape[0] * diff_gray.shape[1]
-    changed_pixels = np.sum(thresh > 0)
-    difference_percentage = (changed_pixels / total_pixels) * 100
-    
-    return {
-        'difference_percentage': float(difference_percentage),
-        'changed_pixels': int(changed_pixels),
-        'total_pixels': int(total_pixels),
-        'mean_difference': float(np.mean(diff_gray)),
-        'max_difference': int(np.max(diff_gray))
-    }, heatmap, thresh
+    if options.get('scales') is None and options.get('angles') is None:
+        return None
+    scales = _number_list(options.get('scales', [1.0]), 'scales')
+    angles = _number_list(options.get('angles', [0]), 'angles')
+    stop_confidence = options.get('stop_confidence', 0.95)
+    if not scales or not all(0.1 <= scale <= 10 for scale in scales):
+        raise BadRequestError('scales must lie between 0.1 and 10')
+    if not angles or not all(-180 <= angle <= 180 for angle in angles):
+        raise BadRequestError('angles must lie between -180 and 180 degrees')
+    if len(scales) * len(angles) > MAX_SWEEP_CANDIDATES:
+        raise BadRequestError(f'At most {MAX_SWEEP_CANDIDATES} scale/angle combinations per request')
+    if not isinstance(stop_confidence, (int, float)) or isinstance(stop_confidence, bool):
+        raise BadRequestError('stop_confidence must be a number')
+    if options.get('min_confidence') is not None:
+        raise BadRequestError('min_confidence cannot be combined with scales/angles')
+    return tuple(scales), tuple(angles), float(stop_confidence)
+
+# ========================================
+# Single-Metric Helpers
+# ========================================
+
+def calculate_ssim(img1, img2, window='box', tile_size='auto'):
+    """Run the SSIM stages on two decoded images. Returns (score, diff_colored)."""
+    results = compare_pipeline.run(
+        ['ssim', 'ssim_diff'], img1=img1, img2=img2, ssim_window=window, tile_size=tile_size
+    )
+    return results['ssim'][0], results['ssim_diff']
+
+def feature_matching(img1, img2):
+    """Run the ORB stages on two decoded images. Returns (score, visualization, stats)."""
+    results = compare_pipeline.run(['features', 'feature_matches'], img1=img1, img2=img2)
+    score, stats = results['features'][:2]
+    return score, results['feature_matches'], stats
+
+def calculate_ms_ssim(img1, img2):
+    """Run the MS-SSIM stages on two decoded images. Returns {'score', 'levels', 'interpretation'}."""
+    return compare_pipeline.run(['ms_ssim'], img1=img1, img2=img2)['ms_ssim']
+
+def histogram_comparison(img1, img2):
+    """Run the histogram stages on two decoded images."""
+    return compare_pipeline.run(['histogram'], img1=img1, img2=img2)['histogram']
+
+def edge_detection_compare(img1, img2, low_threshold=50, high_threshold=150):
+    """Run the Canny stages on two decoded images. Returns (similarity, edges1, edges2, diff)."""
+    results = compare_pipeline.run(
+        ['edge_compare', 'edges', 'edge_diff'], img1=img1, img2=img2,
+        canny_thresholds=(low_threshold, high_threshold)
+    )
+    edges1, edges2 = results['edges']
+    return results['edge_compare'], edges1, edges2, results['edge_diff']
+
+def absolute_difference(img1, img2, threshold=30, tile_size='auto'):
+    """Run the pixel difference stages on two decoded images. Returns (stats, heatmap, thresh)."""
+    results = compare_pipeline.run(
+        ['pixel_diff', 'heatmap', 'threshold_mask'], img1=img1, img2=img2,
+        diff_threshold=threshold, tile_size=tile_size
+    )
+    return results['pixel_diff'], results['heatmap'], results['threshold_mask']
+
+# ========================================
+# Template Matching
+# ========================================
 
-def template_matching(source_img, template_img):
+def template_matching(source_img, template_img, search='exhaustive', multi=None, sweep=None, engine='auto'):
     """
     Find the location of template_img within source_img.
+    `search` is 'exhaustive' (full resolution) or 'pyramid' (coarse-to-fine).
+    With `multi` = (min_confidence, max_results) every occurrence above
+    min_confidence is returned as well (stats['matches']).
+    With `sweep` = (scales, angles, stop_confidence) resized/rotated copies
+    of the template are tried on the compare thread pool.
+    `engine` picks the correlation engine ('auto', 'spatial' or 'fft').
     Returns the location, confidence, and visualization.
     """
     # Convert to grayscale
     if len(source_img.shape) == 3:
-        gray_source = cv2.cvtColor(source_img, cv2.COLOR_BGR2GRAY)
+        gray_source = gray_image(source_img)
     else:
         gray_source = source_img
         
     if len(template_img.shape) == 3:
-        gray_template = cv2.cvtColor(template_img, cv2.COLOR_BGR2GRAY)
+        gray_template = gray_image(template_img)
     else:
         gray_template = template_img
         
@@ -269,39 +650,187 @@ def template_matching(source_img, template_img):
         
     # Match template
     # TM_CCOEFF_NORMED returns 1 for perfect match, -1 for inverse
-    res = cv2.matchTemplate(gray_source, gray_template, cv2.TM_CCOEFF_NORMED)
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-    
-    # Get coordinates
-    top_left = max_loc
-    bottom_right = (top_left[0] + tw, top_left[1] + th)
-    
+    source = prepared_source(source_img)
+    stats = locate_template(source, gray_template, search, multi, sweep, engine, executor=compare_executor)
+    if stats is None:
+        return None, None, f"Template ({tw}x{th}) does not fit into the source image at any requested scale"
+
     # Draw rectangle on source image copy
     result_img = source_img.copy()
-    
+    if multi is None:
+        draw_match(result_img, stats, f"Match: {stats['confidence']*100:.1f}%")
+    else:
+        for index, peak in enumerate(stats['matches']):
+            draw_match(result_img, peak, f"#{index} {peak['confidence']*100:.1f}%")
+
+    return stats, result_img, None
+
+def locate_template(source, gray_template, search='exhaustive', multi=None, sweep=None, engine='auto', executor=None):
+    """
+    Search one grayscale template in a grayscale (or prepared) source and
+    return its match stats. With `multi` the full response map is searched
+    once and every occurrence is listed in stats['matches'], best first.
+    With `sweep` the best scale/angle is reported (None if nothing fits).
+    """
+    th, tw = gray_template.shape
+    if sweep is not None:
+        scales, angles, stop_confidence = sweep
+        found = match_sweep(source, gray_template, scales, angles, search, stop_confidence, executor, engine)
+        if found is None:
+            return None
+        confidence, loc, used, (width, height), scale, angle, tried = found
+        stats = match_stats(confidence, loc, width, height, search, used)
+        stats.update({'scale': scale, 'angle': angle, 'candidates_tried': tried})
+        return stats
+
+    if multi is None:
+        max_val, max_loc, used = match_template(source, gray_template, search, engine)
+        return match_stats(max_val, max_loc, tw, th, search, used)
+
+    # Peaks need the whole response map, so multi-instance search is always exhaustive
+    min_confidence, max_results = multi
+    max_val, max_loc, used, peaks = match_all(source, gray_template, min_confidence, max_results, engine)
+    stats = match_stats(max_val, max_loc, tw, th, 'exhaustive', used)
+    stats['matches'] = [
+        {'confidence': float(confidence), 'location': match_stats(confidence, loc, tw, th, None, None)['location']}
+        for confidence, loc in peaks
+    ]
+    return stats
+
+def match_stats(confidence, top_left, width, height, search, engine):
+    """The `match` section of a template matching response."""
+    return {
+        'confidence': float(confidence),
+        'location': {
+            'x': int(top_left[0]),
+            'y': int(top_left[1]),
+            'width': int(width),
+            'height': int(height)
+        },
+        'search': search,
+        'engine': engine
+    }
+
+def draw_match(result_img, stats, text):
+    """Draw a match rectangle and label onto result_img (in place)."""
+    confidence = stats['confidence']
+    location = stats['location']
+    top_left = (location['x'], location['y'])
+    bottom_right = (top_left[0] + location['width'], top_left[1] + location['height'])
+
     # Color based on confidence (Green > 0.8, Yellow > 0.5, Red < 0.5)
     color = (0, 255, 0)
-    if max_val < 0.8:
+    if confidence < 0.8:
         color = (0, 255, 255)
-    if max_val < 0.5:
+    if confidence < 0.5:
         color = (0, 0, 255)
-        
+
     cv2.rectangle(result_img, top_left, bottom_right, color, 3)
-    
+
     # Add confidence text
-    text = f"Match: {max_val*100:.1f}%"
-    cv2.putText(result_img, text, (top_left[0], top_left[1] - 10), 
+    cv2.putText(result_img, text, (top_left[0], top_left[1] - 10),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
-                
-    return {
-        'confidence': float(max_val),
-        'location': {
-            'x': int(top_left[0]),
-            'y': int(top_left[1]),
-            'width': int(tw),
-            'height': int(th)
-        }
-    }, result_img, None
+
+def match_templates(source_img, template_buffers, search='exhaustive', multi=None, sweep=None, engine='auto',
+                    executor=None):
+    """
+    Find every template in one source image.
+
+    The source is decoded, converted to grayscale and prepared once; the
+    templates are decoded and matched concurrently on `executor`.
+    Returns one {'match': stats} or {'error': message} per template.
+    """
+    results = [None] * len(template_buffers)
+    for index, result in iter_template_matches(source_img, template_buffers, search, multi, sweep, engine, executor):
+        results[index] = result
+    return results
+
+def iter_template_matches(source_img, template_buffers, search='exhaustive', multi=None, sweep=None,
+                          engine='auto', executor=None):
+    """match_templates() as an iterator of (template index, result) in completion order."""
+    source = prepared_source(source_img)
+    sh, sw = source.shape
+
+    def match_one(index):
+        template = decode_image(template_buffers[index])
+        if template is None:
+            return {'error': 'Failed to decode template'}
+        gray_template = gray_image(template) if len(template.shape) == 3 else template
+        th, tw = gray_template.shape
+        if th > sh or tw > sw:
+            return {'error': f"Template ({tw}x{th}) is larger than source image ({sw}x{sh})"}
+        # Sweeps run sequentially here: the templates already share the pool
+        stats = locate_template(source, gray_template, search, multi, sweep, engine)
+        if stats is None:
+            return {'error': f"Template ({tw}x{th}) does not fit into the source image at any requested scale"}
+        return {'match': stats}
+
+    return iter_completed(executor, match_one, range(len(template_buffers)))
+
+# ========================================
+# Streaming Responses
+# ========================================
+# Batch endpoints answer `Accept: application/x-ndjson` with one JSON
+# object per line, flushed as soon as each pair/template is done, so
+# clients see results early and nothing is accumulated server-side.
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+def wants_ndjson():
+    """True if the client prefers NDJSON over a single JSON document."""
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def ndjson_response(records):
+    """
+    Stream an iterable of dicts as NDJSON. Errors raised while streaming
+    (after the 200 status went out) become a final {"error": ...} line.
+    """
+    def generate():
+        try:
+            for record in records:
+                yield json.dumps(record) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+    return app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+def cached_result(endpoint, params=(), required=('image1', 'image2')):
+    """
+    Read the image request once and serve it from result_cache when possible.
+
+    The wrapped view receives (images, options). Requests missing one of the
+    `required` images go straight to the view (which reports the error).
+    Only the options listed in `params` (plus the image encoding options)
+    are part of the cache key, so they must cover everything that changes
+    the response. Successful responses are stored as JSON bodies, except
+    image_output=url responses, whose artifact links expire sooner than a
+    cached result would, and streamed NDJSON responses, which bypass the
+    cache entirely.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper():
+            try:
+                images, options = read_image_request()
+            except BadRequestError as e:
+                return jsonify({'error': str(e)}), 400
+
+            if any(name not in images for name in required) or wants_ndjson():
+                return view(images, options)
+
+            key = result_cache.key(endpoint, images, {name: options.get(name) for name in params + ENCODE_PARAMS})
+            body = result_cache.get(key)
+            if body is not None:
+                response = app.response_class(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(images, options))
+            if response.status_code == 200 and options.get('image_output') != 'url':
+                result_cache.put_response(key, response.get_data())
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
 
 # ========================================
 # API Routes
@@ -312,158 +841,726 @@ def health_check():
     """Health check endpoint."""
     return jsonify({
         'status': 'healthy',
-        'opencv_version': cv2.__version__
+        'opencv_version': cv2.__version__,
+        'compare_threads': COMPARE_THREADS,
+        'opencv_threads': OPENCV_THREADS,
+        'compute_processes': COMPUTE_PROCESSES
     })
 
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """Cache counters (hits, misses, evictions, size)."""
+    return jsonify({
+        'results': result_cache.stats(),
+        'images': image_cache.stats(),
+        'artifacts': artifact_store.stats()
+    })
+
+@app.route('/api/cache', methods=['DELETE'])
+def cache_clear():
+    """Drop all cached results, decoded images and artifacts."""
+    result_cache.clear()
+    image_cache.clear()
+    artifact_store.clear()
+    return jsonify({'success': True})
+
+@app.route('/api/artifacts/<artifact_id>.<extension>', methods=['GET'])
+def get_artifact(artifact_id, extension):
+    """
+    Serve an encoded visualization produced with image_output=url.
+    Artifacts are immutable (the id is a content hash), so clients may
+    cache them until they expire and revalidate with If-None-Match.
+    """
+    artifact = artifact_store.get_artifact(artifact_id)
+    if artifact is None:
+        return jsonify({'error': 'Artifact not found or expired'}), 404
+    data, mimetype, remaining = artifact
+    if IMAGE_MIMETYPES.get({'jpg': 'jpeg'}.get(extension, extension)) != mimetype:
+        return jsonify({'error': 'Artifact not found or expired'}), 404
+
+    response = app.response_class(data, mimetype=mimetype)
+    response.set_etag(artifact_id)
+    response.headers['Cache-Control'] = f'private, max-age={int(remaining)}, immutable'
+    return response.make_conditional(request)
+
 @app.route('/api/compare', methods=['POST'])
-def compare_images():
+@cached_result('compare', params=('metrics', 'visualize', 'ssim_window', 'tile_size'))
+def compare_images(images, data):
     """
     Main comparison endpoint.
-    Accepts two base64 encoded images and returns all comparison metrics.
+    Accepts two images (base64 JSON or binary upload) and returns all comparison metrics.
+    Optional `metrics` and `visualize` (list or false) limit the work to what the caller reads.
     """
     try:
-        data = request.json
-        
-        if 'image1' not in data or 'image2' not in data:
+        if 'image1' not in images or 'image2' not in images:
             return jsonify({'error': 'Both image1 and image2 are required'}), 400
         
-        # Decode images
-        img1 = decode_base64_image(data['image1'])
-        img2 = decode_base64_image(data['image2'])
-        
-        if img1 is None or img2 is None:
-            return jsonify({'error': 'Failed to decode images'}), 400
-        
-        # Calculate SSIM
-        ssim_score, ssim_diff = calculate_ssim(img1, img2)
-        
-        # Feature matching
-        feature_score, feature_img, feature_stats = feature_matching(img1, img2)
+        metrics, visualize = compare_targets(data)
         
-        # Histogram comparison
-        histogram_scores = histogram_comparison(img1, img2)
+        # Decode, preprocess and score in one pass over the stage graph
+        results = run_compare(
+            images,
+            metrics,
+            visualize,
+            {
+                'canny_thresholds': (50, 150),
+                'diff_threshold': 30,
+                'ssim_window': ssim_window_option(data),
+                'tile_size': tile_size_option(data)
+            },
+            encode_options(data)
+        )
         
-        # Edge detection
-        edge_similarity, edges1, edges2, edge_diff = edge_detection_compare(img1, img2)
-        
-        # Absolute difference
-        abs_diff_stats, heatmap, diff_thresh = absolute_difference(img1, img2)
+        sections = {name: results[METRICS[name]] for name in metrics}
+        for name in visualize:
+            section, key = VISUALIZATIONS[name]
+            sections[section][key] = results[f'{name}_encoded']
         
         return jsonify({
             'success': True,
-            'results': {
-                'ssim': {
-                    'score': float(ssim_score),
-                    'interpretation': 'identical' if ssim_score > 0.95 else 'similar' if ssim_score > 0.8 else 'different',
-                    'diff_image': encode_image_base64(ssim_diff)
-                },
-                'features': {
-                    'match_score': float(feature_score),
-                    'stats': feature_stats,
-                    'visualization': encode_image_base64(feature_img)
-                },
-                'histogram': histogram_scores,
-                'edges': {
-                    'similarity': float(edge_similarity),
-                    'diff_image': encode_image_base64(edge_diff)
-                },
-                'pixel_diff': {
-                    **abs_diff_stats,
-                    'heatmap': encode_image_base64(heatmap),
-                    'threshold_mask': encode_image_base64(diff_thresh)
-                }
-            }
+            'image_format': data.get('image_format', 'png'),
+            'results': sections
         })
         
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ssim', methods=['POST'])
-def ssim_endpoint():
+@cached_result('ssim', params=('ssim_window', 'tile_size'))
+def ssim_endpoint(images, data):
     """Calculate SSIM only."""
     try:
-        data = request.json
-        img1 = decode_base64_image(data['image1'])
-        img2 = decode_base64_image(data['image2'])
+        img1 = decode_image(images['image1'])
+        img2 = decode_image(images['image2'])
         
-        score, diff = calculate_ssim(img1, img2)
+        score, diff = calculate_ssim(img1, img2, ssim_window_option(data), tile_size_option(data))
         
+        output = encode_options(data)
         return jsonify({
             'score': float(score),
-            'diff_image': encode_image_base64(diff)
+            'diff_image': image_payload(diff, output),
+            'image_format': output['format']
         })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ms-ssim', methods=['POST'])
+@cached_result('ms-ssim')
+def ms_ssim_endpoint(images, data):
+    """Calculate Multi-Scale SSIM only."""
+    try:
+        img1 = decode_image(images['image1'])
+        img2 = decode_image(images['image2'])
+        
+        return jsonify(calculate_ms_ssim(img1, img2))
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/features', methods=['POST'])
-def features_endpoint():
+@cached_result('features')
+def features_endpoint(images, data):
     """Feature matching only."""
     try:
-        data = request.json
-        img1 = decode_base64_image(data['image1'])
-        img2 = decode_base64_image(data['image2'])
+        img1 = decode_image(images['image1'])
+        img2 = decode_image(images['image2'])
         
         score, result, stats = feature_matching(img1, img2)
         
+        output = encode_options(data)
         return jsonify({
             'match_score': float(score),
             'stats': stats,
-            'visualization': encode_image_base64(result)
+            'visualization': image_payload(result, output),
+            'image_format': output['format']
         })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/edges', methods=['POST'])
-def edges_endpoint():
+@cached_result('edges', params=('low_threshold', 'high_threshold'))
+def edges_endpoint(images, data):
     """Edge detection comparison."""
     try:
-        data = request.json
-        img1 = decode_base64_image(data['image1'])
-        img2 = decode_base64_image(data['image2'])
+        img1 = decode_image(images['image1'])
+        img2 = decode_image(images['image2'])
         
         low = data.get('low_threshold', 50)
         high = data.get('high_threshold', 150)
         
         similarity, edges1, edges2, diff = edge_detection_compare(img1, img2, low, high)
         
+        output = encode_options(data)
         return jsonify({
             'similarity': float(similarity),
-            'edges1': encode_image_base64(edges1),
-            'edges2': encode_image_base64(edges2),
-            'diff_image': encode_image_base64(diff)
+            'edges1': image_payload(edges1, output),
+            'edges2': image_payload(edges2, output),
+            'diff_image': image_payload(diff, output),
+            'image_format': output['format']
         })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/template-match', methods=['POST'])
-def template_match_endpoint():
-    """Template matching endpoint."""
+@cached_result('template-match', params=('search', 'engine', 'min_confidence', 'max_results', 'scales', 'angles', 'stop_confidence'))
+def template_match_endpoint(images, data):
+    """
+    Template matching endpoint.
+    Optional `search`: 'exhaustive' (default) or 'pyramid' for large sources.
+    Optional `min_confidence` (and `max_results`) return every occurrence.
+    Optional `scales` / `angles` sweep resized and rotated templates.
+    Optional `engine`: 'auto' (default), 'spatial' or 'fft'.
+    """
     try:
-        data = request.json
-        if 'image1' not in data or 'image2' not in data:
+        if 'image1' not in images or 'image2' not in images:
             return jsonify({'error': 'Both image1 (Source) and image2 (Template) are required'}), 400
             
-        source = decode_base64_image(data['image1'])
-        template = decode_base64_image(data['image2'])
+        source = decode_image(images['image1'])
+        template = decode_image(images['image2'])
+        if source is None or template is None:
+            raise ImageDecodeError('Failed to decode images')
         
-        stats, result_img, error = template_matching(source, template)
+        stats, result_img, error = template_matching(
+            source, template, search_option(data), multi_match_option(data), sweep_option(data),
+            engine_option(data)
+        )
         
         if error:
             return jsonify({'success': False, 'error': error}), 400
             
+        output = encode_options(data)
         return jsonify({
             'success': True,
+            'image_format': output['format'],
             'results': {
                 'match': stats,
-                'visualization': encode_image_base64(result_img)
+                'visualization': image_payload(result_img, output)
             }
         })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/template-match/batch', methods=['POST'])
+@cached_result(
+    'template-match-batch',
+    params=('search', 'engine', 'visualize', 'min_confidence', 'max_results', 'scales', 'angles', 'stop_confidence'),
+    required=('image1', 'templates')
+)
+def template_match_batch_endpoint(images, data):
+    """
+    Batch template matching: one source (image1) and N `templates`.
+    Returns one result per template, in upload order, plus one visualization
+    with all matches (skip it with visualize=false).
+
+    With `Accept: application/x-ndjson` every template result is streamed
+    as soon as it is found (completion order, with its upload `index`); the
+    final {"done"} line carries the visualization.
+    """
+    try:
+        if 'image1' not in images or not images.get('templates'):
+            return jsonify({'error': 'image1 (Source) and at least one template are required'}), 400
+        if len(images['templates']) > MAX_BATCH_TEMPLATES:
+            return jsonify({'error': f'At most {MAX_BATCH_TEMPLATES} templates per request'}), 400
+
+        source = decode_image(images['image1'])
+        if source is None:
+            raise ImageDecodeError('Failed to decode source image')
+
+        search = search_option(data)
+        output = encode_options(data)
+        visualize = data.get('visualize', True) is not False
+
+        if wants_ndjson():
+            found = iter_template_matches(
+                source, images['templates'], search, multi_match_option(data), sweep_option(data),
+                engine_option(data), executor=compare_executor
+            )
+
+            def records():
+                yield {'success': True, 'image_format': output['format'], 'count': len(images['templates'])}
+                # Matches are drawn as they arrive, only the image is kept
+                result_img = source.copy() if visualize else None
+                for index, result in found:
+                    if visualize and 'match' in result:
+                        for peak in result['match'].get('matches', [result['match']]):
+                            draw_match(result_img, peak, f"#{index} {peak['confidence']*100:.1f}%")
+                    yield {'index': index, **result}
+                done = {'done': True}
+                if visualize:
+                    done['visualization'] = image_payload(result_img, output)
+                yield done
+            return ndjson_response(records())
+
+        matches = match_templates(
+            source, images['templates'], search, multi_match_option(data), sweep_option(data),
+            engine_option(data), executor=compare_executor
+        )
+
+        results = {'templates': [{'index': index, **result} for index, result in enumerate(matches)]}
+        if visualize:
+            result_img = source.copy()
+            for item in results['templates']:
+                if 'match' not in item:
+                    continue
+                for peak in item['match'].get('matches', [item['match']]):
+                    draw_match(result_img, peak, f"#{item['index']} {peak['confidence']*100:.1f}%")
+            results['visualization'] = image_payload(result_img, output)
+
+        return jsonify({
+            'success': True,
+            'image_format': output['format'],
+            'results': results
+        })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/compare/batch', methods=['POST'])
+@cached_result('compare-batch', params=('metrics', 'ssim_window', 'tile_size'), required=('images',))
+def compare_batch_endpoint(images, data):
+    """
+    Batch comparison of a list of `images`, each preprocessed once.
+    With a baseline in image1 every image is compared against it (one score
+    list per metric); without, every pair of images is compared once (one
+    symmetric N x N matrix per metric).
+
+    With `Accept: application/x-ndjson` the scores are streamed instead:
+    a header line, one line per pair as it completes ({"index"} for
+    baseline runs, {"i", "j"} for matrices) and a final {"done"} line.
+    """
+    try:
+        if not images.get('images'):
+            return jsonify({'error': 'At least one image is required'}), 400
+        if len(images['images']) > MAX_BATCH_IMAGES:
+            return jsonify({'error': f'At most {MAX_BATCH_IMAGES} images per request'}), 400
+        metrics = _select(data.get('metrics'), list(BATCH_METRICS), 'metrics', DEFAULT_BATCH_METRICS)
+        window = ssim_window_option(data)
+
+        decoded = []
+        for index, buffer in enumerate(images['images']):
+            img = decode_image(buffer)
+            if img is None:
+                raise ImageDecodeError(f'Failed to decode image {index}')
+            decoded.append(img)
+        baseline = None
+        if 'image1' in images:
+            baseline = decode_image(images['image1'])
+            if baseline is None:
+                raise ImageDecodeError('Failed to decode baseline image')
+
+        everything = decoded if baseline is None else [baseline, *decoded]
+        tile_size = effective_tile_size(common_size(everything), tile_size_option(data))
+        options = dict(executor=compare_executor, window=window, tile_size=tile_size,
+                       moments_bytes=BATCH_MOMENTS_MB * 1024 * 1024)
+        header = {
+            'mode': 'matrix' if baseline is None else 'baseline',
+            'count': len(decoded),
+            'scores': {metric: BATCH_METRICS[metric] for metric in metrics}
+        }
+
+        if wants_ndjson():
+            if baseline is None:
+                (height, width), pairs = matrix_scores(decoded, metrics, **options)
+                lines = ({'i': i, 'j': j, **values} for (i, j), values in pairs)
+            else:
+                (height, width), pairs = baseline_scores(baseline, decoded, metrics, **options)
+                lines = ({'index': index, **values} for index, values in pairs)
+
+            def records():
+                yield {'success': True, **header, 'size': {'width': width, 'height': height}}
+                count = 0
+                for count, line in enumerate(lines, 1):
+                    yield line
+                yield {'done': True, 'pairs': count}
+            return ndjson_response(records())
+
+        if baseline is None:
+            scores, (height, width) = compare_matrix(decoded, metrics, **options)
+        else:
+            scores, (height, width) = compare_baseline(baseline, decoded, metrics, **options)
+
+        return jsonify({
+            'success': True,
+            **header,
+            'size': {'width': width, 'height': height},
+            'results': {metric: values.tolist() for metric, values in scores.items()}
+        })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def job_arguments(kind, images, data):
+    """Validate a job submission and return the positional arguments of its job kind."""
+    if kind == 'ssim':
+        if 'image1' not in images or 'image2' not in images:
+            raise BadRequestError('Both image1 and image2 are required')
+        tile_size = tile_size_option(data)
+        return images['image1'], images['image2'], ssim_window_option(data), tile_size if tile_size != 'auto' else TILE_SIZE
+
+    if kind == 'compare_batch':
+        if not images.get('images'):
+            raise BadRequestError('At least one image is required')
+        if len(images['images']) > MAX_BATCH_IMAGES:
+            raise BadRequestError(f'At most {MAX_BATCH_IMAGES} images per request')
+        metrics = _select(data.get('metrics'), list(BATCH_METRICS), 'metrics', DEFAULT_BATCH_METRICS)
+        return (
+            images['images'], images.get('image1'), metrics, ssim_window_option(data),
+            tile_size_option(data), (TILE_SIZE, TILED_MIN_PIXELS)
+        )
+
+    if kind == 'template_sweep':
+        if 'image1' not in images or 'image2' not in images:
+            raise BadRequestError('Both image1 (Source) and image2 (Template) are required')
+        sweep = sweep_option(data)
+        if sweep is None:
+            raise BadRequestError('template_sweep jobs need scales and/or angles')
+        scales, angles, stop_confidence = sweep
+        return images['image1'], images['image2'], scales, angles, search_option(data), stop_confidence, engine_option(data)
+
+    raise BadRequestError(f"Unknown job kind '{kind}'. Choose from {', '.join(JOB_KINDS)}")
+
+@app.route('/api/jobs', methods=['POST'])
+def job_submit():
+    """
+    Submit a long-running comparison (`kind`: ssim, compare_batch or
+    template_sweep) with the same images and options as its endpoint.
+    Answers 202 with the job status; poll /api/jobs/<id>.
+    """
+    try:
+        images, data = read_image_request()
+        # Raw bytes are pickled to the worker; request buffers may be memoryviews
+        images = {name: [bytes(item) for item in value] if isinstance(value, list) else bytes(value)
+                  for name, value in images.items()}
+        kind = data.get('kind')
+        status = job_manager.submit(kind, *job_arguments(kind, images, data))
+        response = jsonify({'success': True, 'job': status})
+        response.status_code = 202
+        response.headers['Location'] = f"/api/jobs/{status['id']}"
+        return response
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def job_list():
+    """All jobs that are queued, running or finished within the TTL."""
+    return jsonify({'jobs': job_manager.list(), 'stats': job_manager.stats()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and progress (0..1) of a job."""
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify({'job': status})
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Result of a finished job; 409 while it is not done."""
+    status, result = job_manager.result(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if status['status'] != 'done':
+        return jsonify({'error': f"Job is {status['status']}", 'job': status}), 409
+    return jsonify({'success': True, 'job': status, 'results': result})
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def job_cancel(job_id):
+    """Cancel a queued or running job."""
+    status = job_manager.cancel(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify({'success': True, 'job': status})
+
+@app.route('/api/features/index', methods=['POST'])
+def feature_index_register():
+    """
+    Register reference images (`references`) in the persistent ORB index.
+    Registration is idempotent: references are identified by content hash.
+    """
+    try:
+        items, _ = read_image_list('references')
+        if not items:
+            return jsonify({'error': 'At least one reference image is required'}), 400
+
+        registered = []
+        for name, buffer in items:
+            img = decode_image(buffer)
+            if img is None:
+                raise ImageDecodeError(f"Failed to decode reference '{name}'")
+            reference, added = feature_index.register(digest(buffer), name, gray_image(img))
+            registered.append({
+                'id': reference['id'],
+                'name': reference['name'],
+                'keypoints': reference['count'],
+                'added': added
+            })
+
+        return jsonify({'success': True, 'references': registered, 'index': feature_index.stats()})
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/features/index', methods=['GET'])
+def feature_index_stats():
+    """Size of the reference index and its registered references."""
+    return jsonify({
+        'index': feature_index.stats(),
+        'references': [
+            {'id': ref['id'], 'name': ref['name'], 'keypoints': ref['count']}
+            for ref in feature_index.store.references
+        ]
+    })
+
+@app.route('/api/features/index', methods=['DELETE'])
+def feature_index_clear():
+    """Remove all registered references."""
+    feature_index.clear()
+    return jsonify({'success': True})
+
+@app.route('/api/features/query', methods=['POST'])
+def feature_index_query():
+    """
+    Identify image1 among the registered references.
+    Returns the `top_k` (default 5) references ranked by good ORB matches.
+    Not served from result_cache: the answer changes with the index.
+    """
+    try:
+        images, data = read_image_request()
+        if 'image1' not in images:
+            return jsonify({'error': 'image1 is required'}), 400
+        top_k = _int_option(data, 'top_k', 5, 1, 100)
+
+        img = decode_image(images['image1'])
+        if img is None:
+            raise ImageDecodeError('Failed to decode image')
+
+        keypoints, ranked = feature_index.query(gray_image(img), top_k)
+        return jsonify({
+            'success': True,
+            'query_keypoints': keypoints,
+            'matches': [
+                {'id': ref['id'], 'name': ref['name'], 'good_matches': votes, 'match_score': score}
+                for ref, votes, score in ranked
+            ]
+        })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def hash_query_options(data):
+    """Validate kind, max_distance and top_k of /api/hash/query."""
+    kind = data.get('kind', 'phash')
+    if kind not in HASH_KINDS:
+        raise BadRequestError(f"Unknown hash kind '{kind}'. Choose from {', '.join(HASH_KINDS)}")
+    return kind, _int_option(data, 'max_distance', 10, 0, MAX_DISTANCE), _int_option(data, 'top_k', 10, 1, 1000)
+
+@app.route('/api/hash/index', methods=['POST'])
+def hash_index_register():
+    """
+    Register one or many reference images (`references`) in the in-memory
+    perceptual-hash index. Idempotent: references are identified by content hash.
+    """
+    try:
+        items, _ = read_image_list('references')
+        if not items:
+            return jsonify({'error': 'At least one reference image is required'}), 400
+
+        registered = []
+        for name, buffer in items:
+            img = decode_image(buffer)
+            if img is None:
+                raise ImageDecodeError(f"Failed to decode reference '{name}'")
+            reference, added = hash_index.register(digest(buffer), name, gray_image(img))
+            registered.append({
+                'id': reference['id'],
+                'name': reference['name'],
+                'hashes': {kind: hash_hex(value) for kind, value in reference['hashes'].items()},
+                'added': added
+            })
+
+        return jsonify({'success': True, 'references': registered, 'index': hash_index.stats()})
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/hash/index', methods=['GET'])
+def hash_index_stats():
+    """Number of references in the perceptual-hash index."""
+    return jsonify({'index': hash_index.stats()})
+
+@app.route('/api/hash/index', methods=['DELETE'])
+def hash_index_clear():
+    """Remove all references from the perceptual-hash index."""
+    hash_index.clear()
+    return jsonify({'success': True})
+
+@app.route('/api/hash/query', methods=['POST'])
+def hash_index_query():
+    """
+    Near-duplicates of image1: references whose `kind` hash (default phash)
+    lies within `max_distance` bits (default 10), closest first.
+    Not served from result_cache: the answer changes with the index.
+    """
+    try:
+        images, data = read_image_request()
+        if 'image1' not in images:
+            return jsonify({'error': 'image1 is required'}), 400
+        kind, max_distance, top_k = hash_query_options(data)
+
+        img = decode_image(images['image1'])
+        if img is None:
+            raise ImageDecodeError('Failed to decode image')
+
+        hashes = image_hashes(gray_image(img))
+        found = hash_index.query(hashes[kind], kind, max_distance)
+        return jsonify({
+            'success': True,
+            'kind': kind,
+            'hashes': {name: hash_hex(value) for name, value in hashes.items()},
+            'matches': [
+                {
+                    'id': reference['id'],
+                    'name': reference['name'],
+                    'distance': distance,
+                    'distances': {name: hamming(value, reference['hashes'][name]) for name, value in hashes.items()}
+                }
+                for reference, distance in found[:top_k]
+            ]
+        })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/histogram/index', methods=['POST'])
+def histogram_index_register():
+    """
+    Register one or many reference images (`references`) in the in-memory
+    color histogram index. Idempotent: references are identified by content hash.
+    """
+    try:
+        items, _ = read_image_list('references')
+        if not items:
+            return jsonify({'error': 'At least one reference image is required'}), 400
+
+        registered = []
+        for name, buffer in items:
+            img = decode_image(buffer)
+            if img is None:
+                raise ImageDecodeError(f"Failed to decode reference '{name}'")
+            reference, added = histogram_index.register(digest(buffer), name, hsv_image(img))
+            registered.append({'id': reference['id'], 'name': reference['name'], 'added': added})
+
+        return jsonify({'success': True, 'references': registered, 'index': histogram_index.stats()})
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/histogram/index', methods=['GET'])
+def histogram_index_stats():
+    """Size of the color histogram index."""
+    return jsonify({'index': histogram_index.stats()})
+
+@app.route('/api/histogram/index', methods=['DELETE'])
+def histogram_index_clear():
+    """Remove all references from the color histogram index."""
+    histogram_index.clear()
+    return jsonify({'success': True})
+
+@app.route('/api/histogram/query', methods=['POST'])
+def histogram_index_query():
+    """
+    The `top_k` (default 5) references with the most similar colors to
+    image1, ranked by `metric` (default correlation). Every match carries
+    all four histogram scores, as in /api/compare.
+    Not served from result_cache: the answer changes with the index.
+    """
+    try:
+        images, data = read_image_request()
+        if 'image1' not in images:
+            return jsonify({'error': 'image1 is required'}), 400
+        metric = data.get('metric', 'correlation')
+        if metric not in HIST_METRICS:
+            raise BadRequestError(f"Unknown histogram metric '{metric}'. Choose from {', '.join(HIST_METRICS)}")
+        top_k = _int_option(data, 'top_k', 5, 1, 1000)
+
+        img = decode_image(images['image1'])
+        if img is None:
+            raise ImageDecodeError('Failed to decode image')
+
+        ranked = histogram_index.query(hsv_image(img), metric, top_k)
+        return jsonify({
+            'success': True,
+            'metric': metric,
+            'matches': [
+                {'id': reference['id'], 'name': reference['name'], **scores}
+                for reference, scores in ranked
+            ]
+        })
+    except BadRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ========================================
+# Server Lifecycle
+# ========================================
+# Hooks for the production server (gunicorn.conf.py): warmup() runs in
+# every worker after forking, shutdown() when the worker exits.
+
+def warmup():
+    """
+    Run one small comparison through every stage and visualization so the
+    first real request does not pay for lazy initialization (OpenCV
+    kernels and buffers, ORB, the compute processes if enabled).
+    """
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (128, 128, 3), dtype=np.uint8)
+    images = {
+        'image1': encode_image(img).tobytes(),
+        'image2': encode_image(np.roll(img, 8, axis=1)).tobytes()
+    }
+    stage_options = {'canny_thresholds': (50, 150), 'diff_threshold': 30, 'ssim_window': 'box', 'tile_size': 'auto'}
+    run_compare(images, list(METRICS), list(VISUALIZATIONS), stage_options, encode_options({}))
+
+def shutdown():
+    """
+    Release the worker pools: queued and running jobs are cancelled (their
+    results would be lost with the process anyway), compute processes and
+    comparison threads finish what they are doing.
+    """
+    job_manager.shutdown(cancel=True)
+    if compute_pool is not None:
+        compute_pool.shutdown()
+    if compare_executor is not None:
+        compare_executor.shutdown()
+
 # ========================================
 # Main Entry Point
 # ========================================
+# Development server with reloader and debugger; serve production traffic
+# with gunicorn (see gunicorn.conf.py).
 
 if __name__ == '__main__':
     print("🔍 Image Compare API - OpenCV Backend")
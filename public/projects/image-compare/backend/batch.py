@@ -0,0 +1,257 @@
+"""
+Batch Comparison
+Author: Kevin Hintermaier
+
+Compare one baseline against many candidates (visual regression) or every
+image of a set against every other (similarity matrix for clustering).
+
+All images are brought to one common size (the largest width and height
+of the set, like /api/compare does for a pair) and preprocessed exactly
+once: grayscale, SSIM moments, ORB features, H-S histogram, Canny edges.
+Per-pair work then reduces to what really depends on both images:
+
+- histogram correlation and edge overlap are computed for all pairs at
+  once with matrix products over the stacked per-image arrays
+- SSIM needs one covariance filter per pair (the per-image means and
+  variances are reused), ORB one descriptor match, pixel difference one
+  absdiff; these pairs run on the executor
+- for a full matrix only pairs i < j are computed and mirrored
+
+baseline_scores() / matrix_scores() yield the scores pair by pair as they
+complete (for streaming responses); compare_baseline() / compare_matrix()
+collect them into one score array per metric: a vector for baseline runs
+and a symmetric N x N matrix otherwise.
+"""
+
+from itertools import chain, combinations
+
+import cv2
+import numpy as np
+
+from histogram_index import hs_histogram
+from pipeline import iter_completed
+from ssim import ms_ssim, ssim_from_moments, ssim_moments, structural_similarity
+from tiled import tiled_abs_diff, tiled_diff_stats, tiled_ssim
+
+# Metric -> the /api/compare score reported in its matrix
+BATCH_METRICS = {
+    'ssim': 'score',
+    'ms_ssim': 'score',
+    'features': 'match_score',
+    'histogram': 'correlation',
+    'edges': 'similarity',
+    'pixel_diff': 'difference_percentage'
+}
+DEFAULT_BATCH_METRICS = ('ssim', 'features', 'histogram', 'edges', 'pixel_diff')
+
+# Same parameters as the pairwise comparison stages
+CANNY_THRESHOLDS = (50, 150)
+DIFF_THRESHOLD = 30
+GOOD_DISTANCE = 50
+
+# Memory for the per-image SSIM moments of one batch
+DEFAULT_MOMENTS_BYTES = 512 * 1024 * 1024
+
+# Pixels per block of the stacked edge product (N x block float32 buffer)
+EDGE_BLOCK_PIXELS = 1 << 16
+
+
+def common_size(images):
+    """(height, width) every image of the set is resized to."""
+    return max(img.shape[0] for img in images), max(img.shape[1] for img in images)
+
+
+def _resize(img, size):
+    h, w = size
+    return img if img.shape[:2] == (h, w) else cv2.resize(img, (w, h))
+
+
+def _map(executor, func, items):
+    items = list(items)
+    if executor is None:
+        return [func(item) for item in items]
+    return list(executor.map(func, items))
+
+
+def preprocess(img, metrics, window='box', moments=True):
+    """Everything the selected metrics need from one (resized) image."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    prepared = {'gray': gray}
+    if 'pixel_diff' in metrics:
+        prepared['image'] = img
+    if 'ssim' in metrics and moments:
+        prepared['moments'] = ssim_moments(gray, window)
+    if 'features' in metrics:
+        orb = cv2.ORB_create(nfeatures=500)
+        prepared['orb'] = orb.detectAndCompute(gray, None)
+    if 'histogram' in metrics:
+        prepared['histogram'] = hs_histogram(cv2.cvtColor(img, cv2.COLOR_BGR2HSV)).ravel()
+    if 'edges' in metrics:
+        edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), *CANNY_THRESHOLDS)
+        prepared['edges'] = np.packbits(edges.ravel() > 0)
+    return prepared
+
+
+def histogram_correlations(histograms, rows):
+    """
+    cv2.HISTCMP_CORREL of histograms[rows] against all histograms,
+    as one centered matrix product. Returns len(rows) x N.
+    """
+    stacked = np.stack(histograms).astype(np.float64)
+    stacked -= stacked.mean(axis=1, keepdims=True)
+    variance = np.einsum('ij,ij->i', stacked, stacked)
+    covariance = stacked[rows] @ stacked.T
+    denominator = np.outer(variance[rows], variance)
+    correlation = np.ones_like(covariance)
+    valid = denominator > np.finfo(np.float64).eps
+    correlation[valid] = covariance[valid] / np.sqrt(denominator[valid])
+    return correlation
+
+
+def edge_similarities(packed_edges, rows):
+    """
+    Edge IoU (as in the pairwise edge comparison) of edges[rows] against
+    all bit-packed edge maps. Intersections are products of the stacked
+    0/1 maps, accumulated over pixel blocks. Returns len(rows) x N.
+    """
+    packed = np.stack(packed_edges)
+    intersection = np.zeros((len(rows), len(packed)), dtype=np.int64)
+    block_bytes = EDGE_BLOCK_PIXELS // 8
+    for start in range(0, packed.shape[1], block_bytes):
+        bits = np.unpackbits(packed[:, start:start + block_bytes], axis=1).astype(np.float32)
+        intersection += np.rint(bits[rows] @ bits.T).astype(np.int64)
+    edge_counts = np.array([int(np.unpackbits(edges).sum()) for edges in packed_edges])
+    union = edge_counts[rows][:, None] + edge_counts[None, :] - intersection
+    similarity = np.zeros(intersection.shape)
+    np.divide(intersection, union, out=similarity, where=union > 0)
+    return similarity
+
+
+def pair_scores(a, b, metrics, window='box', tile_size=0):
+    """Scores of the pairwise metrics for two preprocessed images."""
+    scores = {}
+    if 'ssim' in metrics:
+        if 'moments' in a:
+            scores['ssim'] = ssim_from_moments(a['gray'], b['gray'], a['moments'], b['moments'], window)
+        elif tile_size:
+            scores['ssim'] = tiled_ssim(a['gray'], b['gray'], window, tile_size)[0]
+        else:
+            scores['ssim'] = structural_similarity(a['gray'], b['gray'], window=window)
+    if 'ms_ssim' in metrics:
+        scores['ms_ssim'] = ms_ssim(a['gray'], b['gray'])[0]
+    if 'features' in metrics:
+        (kp1, des1), (kp2, des2) = a['orb'], b['orb']
+        if des1 is None or des2 is None:
+            scores['features'] = 0.0
+        else:
+            matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des1, des2)
+            good = sum(1 for m in matches if m.distance < GOOD_DISTANCE)
+            scores['features'] = good / max(len(kp1), len(kp2)) * 100
+    if 'pixel_diff' in metrics:
+        if tile_size:
+            diff = tiled_abs_diff(a['image'], b['image'], tile_size)
+            scores['pixel_diff'] = tiled_diff_stats(diff, DIFF_THRESHOLD, tile_size)['difference_percentage']
+        else:
+            diff = cv2.cvtColor(cv2.absdiff(a['image'], b['image']), cv2.COLOR_BGR2GRAY)
+            scores['pixel_diff'] = cv2.countNonZero(cv2.compare(diff, DIFF_THRESHOLD, cv2.CMP_GT)) / diff.size * 100
+    return scores
+
+
+def self_score(prepared, metric):
+    """Score of comparing an image with itself (the matrix diagonal)."""
+    if metric == 'features':
+        return 100.0 if prepared['orb'][1] is not None else 0.0
+    if metric == 'edges':
+        return 1.0 if prepared['edges'].any() else 0.0
+    if metric == 'pixel_diff':
+        return 0.0
+    return 1.0
+
+
+def _prepare(images, rows, metrics, executor, window, tile_size, moments_bytes):
+    """Preprocess the set once and compute the vectorized metrics for `rows`."""
+    size = common_size(images)
+    pixels = size[0] * size[1]
+    # SSIM moments are two float32 maps per image; above the budget SSIM
+    # falls back to computing every pair from scratch
+    moments = not tile_size and len(images) * pixels * 8 <= moments_bytes
+    prepared = _map(executor, lambda img: preprocess(_resize(img, size), metrics, window, moments), images)
+
+    vectorized = {}
+    if 'histogram' in metrics:
+        vectorized['histogram'] = histogram_correlations([p['histogram'] for p in prepared], rows)
+    if 'edges' in metrics:
+        vectorized['edges'] = edge_similarities([p['edges'] for p in prepared], rows)
+    return prepared, size, vectorized
+
+
+def _iter_pairs(prepared, vectorized, rows, pairs, metrics, executor, window, tile_size):
+    """Yield ((i, j), {metric: score}) for every pair, in completion order."""
+    row_of = {image: row for row, image in enumerate(rows)}
+    pairwise = [metric for metric in metrics if metric not in vectorized]
+
+    def score(pair):
+        i, j = pair
+        values = pair_scores(prepared[i], prepared[j], pairwise, window, tile_size) if pairwise else {}
+        for metric, matrix in vectorized.items():
+            values[metric] = float(matrix[row_of[i], j])
+        return {metric: float(values[metric]) for metric in metrics}
+
+    yield from iter_completed(executor, score, pairs)
+
+
+def baseline_scores(baseline, candidates, metrics=DEFAULT_BATCH_METRICS, executor=None,
+                    window='box', tile_size=0, moments_bytes=DEFAULT_MOMENTS_BYTES):
+    """
+    Preprocess the set and return ((height, width), iterator) where the
+    iterator yields (candidate index, {metric: score}) as pairs complete.
+    """
+    images = [baseline, *candidates]
+    prepared, size, vectorized = _prepare(images, [0], metrics, executor, window, tile_size, moments_bytes)
+    pairs = ((0, j) for j in range(1, len(images)))
+    results = _iter_pairs(prepared, vectorized, [0], pairs, metrics, executor, window, tile_size)
+    return size, ((j - 1, values) for (_, j), values in results)
+
+
+def matrix_scores(images, metrics=DEFAULT_BATCH_METRICS, executor=None,
+                  window='box', tile_size=0, moments_bytes=DEFAULT_MOMENTS_BYTES):
+    """
+    Preprocess the set and return ((height, width), iterator) where the
+    iterator yields ((i, j), {metric: score}): first the self-comparisons
+    (i, i), which need no work, then every pair i < j as it completes.
+    """
+    count = len(images)
+    rows = list(range(count))
+    prepared, size, vectorized = _prepare(images, rows, metrics, executor, window, tile_size, moments_bytes)
+    diagonal = (((i, i), {metric: self_score(prepared[i], metric) for metric in metrics}) for i in rows)
+    pairs = _iter_pairs(prepared, vectorized, rows, combinations(rows, 2), metrics, executor, window, tile_size)
+    return size, chain(diagonal, pairs)
+
+
+def compare_baseline(baseline, candidates, metrics=DEFAULT_BATCH_METRICS, executor=None,
+                     window='box', tile_size=0, moments_bytes=DEFAULT_MOMENTS_BYTES):
+    """
+    Compare one BGR baseline image against every candidate.
+    Returns ({metric: array of len(candidates)}, (height, width)).
+    """
+    size, results = baseline_scores(baseline, candidates, metrics, executor, window, tile_size, moments_bytes)
+    arrays = {metric: np.empty(len(candidates)) for metric in metrics}
+    for index, values in results:
+        for metric, value in values.items():
+            arrays[metric][index] = value
+    return arrays, size
+
+
+def compare_matrix(images, metrics=DEFAULT_BATCH_METRICS, executor=None,
+                   window='box', tile_size=0, moments_bytes=DEFAULT_MOMENTS_BYTES):
+    """
+    Compare every BGR image of the set with every other, each pair once.
+    Returns ({metric: symmetric N x N array}, (height, width)).
+    """
+    count = len(images)
+    size, results = matrix_scores(images, metrics, executor, window, tile_size, moments_bytes)
+    matrices = {metric: np.empty((count, count)) for metric in metrics}
+    for (i, j), values in results:
+        for metric, value in values.items():
+            matrices[metric][i, j] = matrices[metric][j, i] = value
+    return matrices, size
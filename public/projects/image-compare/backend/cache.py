@@ -0,0 +1,208 @@
+"""
+Result & Image Caches
+Author: Kevin Hintermaier
+
+Content-addressed LRU caches for the comparison endpoints.
+
+- ResultCache: finished responses, keyed on a fast hash of the uploaded
+  image bytes plus endpoint name and parameters, so repeated submissions
+  of the same pair are answered without decoding anything.
+- ImageCache: decoded images (and their gray/HSV derivatives) keyed on
+  the raw-bytes hash, so a reference image reused with different partners
+  is only run through cv2.imdecode once.
+- ArtifactStore: short-lived encoded visualizations served by URL instead
+  of inline base64, keyed on the hash of their own bytes.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def digest(buffer):
+    """Fast 128-bit content hash of raw image bytes."""
+    return hashlib.blake2b(buffer, digest_size=16).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values in bytes.
+    Keeps hit/miss/eviction counters for monitoring.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value or None, marking it as recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store a value, evicting least recently used entries to stay in budget."""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+                self._forget(key, old[0])
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_key, (evicted, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+                self._forget(evicted_key, evicted)
+
+    def _forget(self, key, value):
+        """Hook called (under the lock) when an entry is replaced or evicted."""
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class ResultCache(LRUCache):
+    """LRU cache of finished endpoint responses (serialized JSON bodies)."""
+
+    @staticmethod
+    def key(endpoint, images, params):
+        """Cache key from endpoint, image content (in order) and parameters."""
+        image_digests = [
+            tuple(digest(item) for item in images[name]) if isinstance(images[name], list) else digest(images[name])
+            for name in sorted(images)
+        ]
+        return (endpoint, *image_digests, json.dumps(params, sort_keys=True, default=str))
+
+    def put_response(self, key, body):
+        self.put(key, body, len(body))
+
+
+class ImageCache(LRUCache):
+    """
+    LRU cache from raw-bytes digest to decoded, read-only ndarray.
+
+    Derivatives (gray, HSV, prepared template sources, ...) of a cached
+    image are cached next to it and share its digest. Cached arrays are
+    marked read-only because they are handed to several requests at once;
+    other derivatives only need an `nbytes` size.
+    """
+
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self._digests = {}
+
+    def decode(self, buffer, decoder):
+        """Return decoder(buffer), decoding each distinct byte string only once."""
+        key = digest(buffer)
+        image = self.get((key, 'image'))
+        if image is None:
+            image = decoder(buffer)
+            if image is None:
+                return None
+            image.flags.writeable = False
+            self.put((key, 'image'), image, image.nbytes)
+            with self._lock:
+                if self._entries.get((key, 'image'), (None,))[0] is image:
+                    self._digests[id(image)] = key
+        return image
+
+    def derive(self, image, kind, convert):
+        """
+        Return convert(image), cached alongside `image` if it came from this cache.
+        Images that are not cached (e.g. resized copies) are simply converted.
+        """
+        key = self._digest_of(image)
+        if key is None:
+            return convert(image)
+        derived = self.get((key, kind))
+        if derived is None:
+            derived = convert(image)
+            if hasattr(derived, 'flags'):
+                derived.flags.writeable = False
+            self.put((key, kind), derived, derived.nbytes)
+        return derived
+
+    def _digest_of(self, image):
+        with self._lock:
+            key = self._digests.get(id(image))
+            if key is None:
+                return None
+            entry = self._entries.get((key, 'image'))
+            # id() values are reused after eviction, so confirm the identity
+            if entry is None or entry[0] is not image:
+                return None
+            return key
+
+    def _forget(self, key, value):
+        if key[1] == 'image':
+            self._digests.pop(id(value), None)
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self._digests.clear()
+
+
+class ArtifactStore(LRUCache):
+    """
+    LRU store of encoded images with a time-to-live.
+
+    Artifacts are content addressed: the id is the hash of the encoded
+    bytes, so it doubles as a strong ETag and identical renders share one
+    entry. Expired artifacts are dropped on access.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        super().__init__(max_bytes)
+        self.ttl = ttl
+
+    def put_artifact(self, data, mimetype):
+        """Store encoded bytes and return their artifact id."""
+        artifact_id = digest(data)
+        self.put(artifact_id, (bytes(data), mimetype, time.monotonic() + self.ttl), len(data))
+        return artifact_id
+
+    def get_artifact(self, artifact_id):
+        """Return (data, mimetype, seconds left) or None if unknown or expired."""
+        entry = self.get(artifact_id)
+        if entry is None:
+            return None
+        data, mimetype, expires = entry
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            with self._lock:
+                if self._entries.get(artifact_id, (None,))[0] is entry:
+                    del self._entries[artifact_id]
+                    self.current_bytes -= len(data)
+            return None
+        return data, mimetype, remaining
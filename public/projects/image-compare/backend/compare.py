@@ -0,0 +1,386 @@
+"""
+Pairwise Comparison
+Author: Kevin Hintermaier
+
+The stages of /api/compare: preprocessing, metrics, visualizations and
+result sections of one image pair, and the compare task that runs them in
+a compute process.
+
+Importing this module has no side effects (no caches, pools, indexes or
+OpenCV settings), so the compute processes import it instead of app.py.
+app.py builds its pipeline from compare_stages() with cached gray/HSV
+conversions and the decode and encode stages around them.
+"""
+
+from functools import lru_cache, partial
+
+import cv2
+import numpy as np
+
+from errors import ImageDecodeError
+from histogram_index import hs_histogram
+from pipeline import Pipeline, Stage
+from ssim import ms_ssim, structural_similarity
+from tiled import tiled_abs_diff, tiled_diff_stats, tiled_ssim
+from workers import task
+
+
+# ========================================
+# Shared Preprocessing Stages
+# ========================================
+# Each stage works on a (image1, image2) pair so that the pipeline
+# computes it exactly once per request, no matter how many metrics use it.
+
+def resize_to_match(img1, img2):
+    """Resize images to the same dimensions for comparison."""
+    h1, w1 = img1.shape[:2]
+    h2, w2 = img2.shape[:2]
+
+    # Use the larger dimensions
+    target_h = max(h1, h2)
+    target_w = max(w1, w2)
+
+    # Images that already have the target size are passed through untouched
+    img1_resized = img1 if (h1, w1) == (target_h, target_w) else cv2.resize(img1, (target_w, target_h))
+    img2_resized = img2 if (h2, w2) == (target_h, target_w) else cv2.resize(img2, (target_w, target_h))
+
+    return img1_resized, img2_resized
+
+def prepare_pair(img1, img2):
+    """Validate decoded images and bring them to a common size."""
+    if img1 is None or img2 is None:
+        raise ImageDecodeError('Failed to decode images')
+    return resize_to_match(img1, img2)
+
+def blur(gray):
+    """Apply Gaussian blur to reduce noise."""
+    return tuple(cv2.GaussianBlur(img, (5, 5), 0) for img in gray)
+
+def canny(blurred, thresholds):
+    """Canny edge detection with (low, high) thresholds."""
+    low_threshold, high_threshold = thresholds
+    return tuple(cv2.Canny(img, low_threshold, high_threshold) for img in blurred)
+
+def orb_features(gray):
+    """Find ORB keypoints and descriptors for both images."""
+    orb = cv2.ORB_create(nfeatures=500)
+    return tuple(orb.detectAndCompute(img, None) for img in gray)
+
+def to_gray(pair):
+    """Convert both images to grayscale."""
+    return tuple(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for img in pair)
+
+def to_hsv(pair):
+    """Convert both images to HSV for better color representation."""
+    return tuple(cv2.cvtColor(img, cv2.COLOR_BGR2HSV) for img in pair)
+
+def effective_tile_size(shape, tile_size, tiling):
+    """
+    Resolve the `tile_size` option ('auto', 0 = off, or pixels) for an image
+    shape. `tiling` is the (tile size, minimum pixels) pair behind 'auto'.
+    """
+    if tile_size == 'auto':
+        auto_size, min_pixels = tiling
+        return auto_size if shape[0] * shape[1] > min_pixels else 0
+    return int(tile_size)
+
+def abs_diff(pair, tile_size, tiling):
+    """Absolute pixel difference, converted to grayscale for analysis."""
+    tile_size = effective_tile_size(pair[0].shape, tile_size, tiling)
+    if tile_size:
+        return tiled_abs_diff(pair[0], pair[1], tile_size)
+    diff = cv2.absdiff(pair[0], pair[1])
+    return cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+
+# ========================================
+# OpenCV Comparison Algorithms
+# ========================================
+# Metrics only compute scores; the visualizations are separate render
+# stages further down, so score-only requests never draw or encode images.
+
+def ssim_stage(gray, window, tile_size, tiling):
+    """
+    Calculate Structural Similarity Index (SSIM).
+    SSIM measures perceived quality and structural information.
+    Returns a score from -1 to 1, where 1 means identical, and the full SSIM map.
+    `window` is 'box' (7x7, scikit-image default) or 'gaussian' (11x11, sigma 1.5).
+    Large images are processed in tiles and return the map as uint8 (ssim * 255).
+    """
+    gray1, gray2 = gray
+
+    tile_size = effective_tile_size(gray1.shape, tile_size, tiling)
+    if tile_size:
+        return tiled_ssim(gray1, gray2, window, tile_size)
+
+    # Calculate SSIM
+    score, ssim_map = structural_similarity(gray1, gray2, full=True, window=window)
+
+    return score, ssim_map
+
+def ms_ssim_stage(gray):
+    """
+    Multi-Scale SSIM on a 5-level cv2.pyrDown pyramid.
+    More robust than single-scale SSIM against sub-pixel noise and resampling,
+    and most of the work happens on the smaller levels.
+    """
+    gray1, gray2 = gray
+    score, levels = ms_ssim(gray1, gray2)
+    return {
+        'score': score,
+        'levels': levels,
+        'interpretation': 'identical' if score > 0.95 else 'similar' if score > 0.8 else 'different'
+    }
+
+def feature_stage(features):
+    """
+    Feature detection and matching using ORB (Oriented FAST and Rotated BRIEF).
+    ORB is a fast and efficient alternative to SIFT/SURF.
+    Returns (match_score, stats, keypoints1, keypoints2, sorted_matches).
+    """
+    (kp1, des1), (kp2, des2) = features
+
+    # Handle case where no features found
+    if des1 is None or des2 is None:
+        return 0, [], kp1, kp2, None
+
+    # Create BFMatcher
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+
+    # Match descriptors
+    matches = bf.match(des1, des2)
+
+    # Sort by distance
+    matches = sorted(matches, key=lambda x: x.distance)
+
+    # Calculate match score (percentage of good matches)
+    good_matches = [m for m in matches if m.distance < 50]
+    match_score = len(good_matches) / max(len(kp1), len(kp2)) * 100 if kp1 and kp2 else 0
+
+    return match_score, {
+        'image1_keypoints': len(kp1),
+        'image2_keypoints': len(kp2),
+        'total_matches': len(matches),
+        'good_matches': len(good_matches)
+    }, kp1, kp2, matches
+
+def histogram_stage(hsv):
+    """
+    Compare images using color histogram correlation.
+    Uses HSV color space for better color representation.
+    """
+    hsv1, hsv2 = hsv
+
+    # Calculate normalized histograms
+    hist1 = hs_histogram(hsv1)
+    hist2 = hs_histogram(hsv2)
+
+    # Compare using different methods
+    correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
+    chi_square = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CHISQR)
+    intersection = cv2.compareHist(hist1, hist2, cv2.HISTCMP_INTERSECT)
+    bhattacharyya = cv2.compareHist(hist1, hist2, cv2.HISTCMP_BHATTACHARYYA)
+
+    return {
+        'correlation': float(correlation),  # 1 = identical, -1 = opposite
+        'chi_square': float(chi_square),    # 0 = identical, higher = different
+        'intersection': float(intersection),
+        'bhattacharyya': float(bhattacharyya)  # 0 = identical, 1 = completely different
+    }
+
+def edge_stage(edges):
+    """
+    Compare images using Canny edge detection.
+    Useful for detecting structural changes.
+    """
+    edges1, edges2 = edges
+
+    # Calculate edge similarity
+    intersection = np.count_nonzero((edges1 > 0) & (edges2 > 0))
+    union = np.count_nonzero((edges1 > 0) | (edges2 > 0))
+    similarity = intersection / union if union > 0 else 0
+
+    return similarity
+
+def pixel_diff_stage(diff_gray, threshold, tile_size, tiling):
+    """
+    Calculate absolute pixel difference between images.
+    Returns the statistics; the heatmap and threshold mask are render stages.
+    """
+    tile_size = effective_tile_size(diff_gray.shape, tile_size, tiling)
+    if tile_size:
+        return tiled_diff_stats(diff_gray, threshold, tile_size)
+
+    # Apply threshold to highlight significant differences
+    _, thresh = cv2.threshold(diff_gray, threshold, 255, cv2.THRESH_BINARY)
+
+    # Calculate statistics
+    total_pixels = diff_gray.shape[0] * diff_gray.shape[1]
+    changed_pixels = cv2.countNonZero(thresh)
+    difference_percentage = (changed_pixels / total_pixels) * 100
+
+    return {
+        'difference_percentage': float(difference_percentage),
+        'changed_pixels': int(changed_pixels),
+        'total_pixels': int(total_pixels),
+        'mean_difference': float(np.mean(diff_gray)),
+        'max_difference': int(np.max(diff_gray))
+    }
+
+# ========================================
+# Visualization Stages
+# ========================================
+
+def render_ssim_diff(ssim_output):
+    """Colored SSIM map (JET): red = structurally different."""
+    _, ssim_map = ssim_output
+    # Tiled SSIM already delivers the map as uint8
+    diff = ssim_map if ssim_map.dtype == np.uint8 else (ssim_map * 255).astype("uint8")
+    return cv2.applyColorMap(255 - diff, cv2.COLORMAP_JET)
+
+def render_feature_matches(pair, feature_output):
+    """Side-by-side drawing of the top 30 ORB matches."""
+    img1_resized, img2_resized = pair
+    _, _, kp1, kp2, matches = feature_output
+    if matches is None:
+        return img1_resized
+    return cv2.drawMatches(
+        img1_resized, kp1,
+        img2_resized, kp2,
+        matches[:30],  # Show top 30 matches
+        None,
+        flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS
+    )
+
+def render_edge_diff(edges):
+    """Green = edges only in img1, Red = edges only in img2, White = common."""
+    edges1, edges2 = edges
+    diff = np.zeros((*edges1.shape, 3), dtype=np.uint8)
+    diff[edges1 > 0] = [0, 255, 0]  # Green for image 1
+    diff[edges2 > 0] = [0, 0, 255]  # Red for image 2
+    diff[(edges1 > 0) & (edges2 > 0)] = [255, 255, 255]  # White for both
+    return diff
+
+def render_heatmap(diff_gray):
+    """Colored heatmap (HOT) of the absolute difference."""
+    return cv2.applyColorMap(diff_gray, cv2.COLORMAP_HOT)
+
+def threshold_mask(diff_gray, threshold):
+    """Binary mask of pixels that differ by more than `threshold`."""
+    _, thresh = cv2.threshold(diff_gray, threshold, 255, cv2.THRESH_BINARY)
+    return thresh
+
+# ========================================
+# Result Sections
+# ========================================
+# These build the score part of each /api/compare section; encoded
+# visualizations are merged in by compare_images when requested.
+
+def ssim_result(ssim_output):
+    score = ssim_output[0]
+    return {
+        'score': float(score),
+        'interpretation': 'identical' if score > 0.95 else 'similar' if score > 0.8 else 'different'
+    }
+
+def features_result(feature_output):
+    score, stats = feature_output[:2]
+    return {
+        'match_score': float(score),
+        'stats': stats
+    }
+
+def edges_result(similarity):
+    return {'similarity': float(similarity)}
+
+def pixel_diff_result(stats):
+    return dict(stats)
+
+# Metric name -> stage producing its /api/compare section
+METRICS = {
+    'ssim': 'ssim_result',
+    'features': 'features_result',
+    'histogram': 'histogram',
+    'edges': 'edges_result',
+    'pixel_diff': 'pixel_diff_result',
+    'ms_ssim': 'ms_ssim'
+}
+
+# Metrics computed when the request does not list any (the original response)
+DEFAULT_METRICS = ['ssim', 'features', 'histogram', 'edges', 'pixel_diff']
+
+# Visualization name -> (metric section, response key)
+VISUALIZATIONS = {
+    'ssim_diff': ('ssim', 'diff_image'),
+    'feature_matches': ('features', 'visualization'),
+    'edge_diff': ('edges', 'diff_image'),
+    'heatmap': ('pixel_diff', 'heatmap'),
+    'threshold_mask': ('pixel_diff', 'threshold_mask')
+}
+
+# Visualization name -> upper bound of its size in bytes per pixel of the
+# common image size (feature_matches puts both images side by side)
+VISUALIZATION_BYTES = {
+    'ssim_diff': 3,
+    'feature_matches': 6,
+    'edge_diff': 3,
+    'heatmap': 3,
+    'threshold_mask': 1
+}
+
+# ========================================
+# Stage Graph
+# ========================================
+
+def compare_stages(tiling, gray=to_gray, hsv=to_hsv):
+    """
+    Stages from the decoded pair ('img1', 'img2') to the metric sections
+    and raw visualizations. `tiling` is the (tile size, minimum pixels)
+    pair of tile_size='auto'; `gray` and `hsv` convert the resized pair
+    (app.py passes conversions cached in its image cache).
+    """
+    return [
+        # Preprocessing
+        Stage('resized', prepare_pair, ['img1', 'img2']),
+        Stage('gray', gray, ['resized']),
+        Stage('hsv', hsv, ['resized']),
+        Stage('blur', blur, ['gray']),
+        Stage('edges', canny, ['blur', 'canny_thresholds']),
+        Stage('orb', orb_features, ['gray']),
+        Stage('diff', partial(abs_diff, tiling=tiling), ['resized', 'tile_size']),
+        # Metrics
+        Stage('ssim', partial(ssim_stage, tiling=tiling), ['gray', 'ssim_window', 'tile_size']),
+        Stage('ms_ssim', ms_ssim_stage, ['gray']),
+        Stage('features', feature_stage, ['orb']),
+        Stage('histogram', histogram_stage, ['hsv']),
+        Stage('edge_compare', edge_stage, ['edges']),
+        Stage('pixel_diff', partial(pixel_diff_stage, tiling=tiling), ['diff', 'diff_threshold', 'tile_size']),
+        # Visualizations
+        Stage('ssim_diff', render_ssim_diff, ['ssim']),
+        Stage('feature_matches', render_feature_matches, ['resized', 'features']),
+        Stage('edge_diff', render_edge_diff, ['edges']),
+        Stage('heatmap', render_heatmap, ['diff']),
+        Stage('threshold_mask', threshold_mask, ['diff', 'diff_threshold']),
+        # Result sections
+        Stage('ssim_result', ssim_result, ['ssim']),
+        Stage('features_result', features_result, ['features']),
+        Stage('edges_result', edges_result, ['edge_compare']),
+        Stage('pixel_diff_result', pixel_diff_result, ['pixel_diff']),
+    ]
+
+@lru_cache(maxsize=None)
+def _task_pipeline(tiling):
+    return Pipeline(compare_stages(tiling))
+
+@task('compare')
+def compare_task(arrays, targets, visualize, stage_options, tiling):
+    """
+    Worker side of app.run_compare(): score the decoded pair and render the
+    raw visualizations, which go back through shared memory.
+    """
+    results = _task_pipeline(tiling).run(
+        targets + visualize,
+        img1=arrays['img1'],
+        img2=arrays['img2'],
+        **stage_options
+    )
+    return {name: results[name] for name in targets}, {name: results[name] for name in visualize}
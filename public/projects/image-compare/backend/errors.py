@@ -0,0 +1,15 @@
+"""
+Request Errors
+Author: Kevin Hintermaier
+
+Exceptions the routes answer with 400. They live apart from app.py so the
+comparison stages (compare.py) can raise them without importing the app.
+"""
+
+
+class BadRequestError(ValueError):
+    """Raised for malformed uploads; the routes answer these with 400."""
+
+
+class ImageDecodeError(BadRequestError):
+    """Raised when an uploaded image cannot be decoded."""
@@ -0,0 +1,58 @@
+"""
+Gunicorn Configuration
+Author: Kevin Hintermaier
+
+Production entry point of the Image Compare API:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+- The app is imported once in the master before the workers are forked
+  (preload_app), so OpenCV, NumPy and the module state are shared
+  copy-on-write instead of being loaded per worker.
+- Job table, artifacts and the in-memory reference indexes live in the
+  web worker, so by default there is one worker with many threads. A
+  comparison runs its metrics in parallel on the worker's compare thread
+  pool and reuses the cached gray/HSV images (lowest latency per
+  request). COMPUTE_PROCESSES > 0 moves comparisons to compute processes
+  instead: more throughput under many concurrent comparisons, but each
+  one runs its metrics sequentially without the image cache.
+- Every worker runs app.warmup() after forking and app.shutdown() when it
+  exits; in-flight requests get GRACEFUL_TIMEOUT seconds to finish.
+
+Settings are read from the environment, see README.md.
+"""
+
+import os
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 16))
+
+preload_app = True
+
+# Long enough for a tiled comparison of a large scan; longer work belongs
+# into /api/jobs
+timeout = int(os.getenv('WORKER_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+# Idle keep-alive connections wait in the gthread poller without holding a
+# thread; behind a load balancer set this above its idle timeout
+keepalive = int(os.getenv('KEEPALIVE', 5))
+
+# Worker heartbeats on tmpfs, a slow disk cannot stall them
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = os.getenv('ACCESS_LOG', '-')
+
+
+def post_worker_init(worker):
+    # Runs after forking: OpenCV's worker threads must not exist in the
+    # master when it forks
+    import app
+    app.warmup()
+    worker.log.info('Worker %s warmed up', worker.pid)
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
@@ -0,0 +1,197 @@
+"""
+Histogram Index
+Author: Kevin Hintermaier
+
+Color-based retrieval over a corpus of images.
+
+Every image is reduced to the same 50x60 H-S histogram as the pairwise
+histogram comparison, min-max normalized and stored as one column of a
+contiguous float32 matrix (bins x references). A query computes
+correlation, chi-square, intersection and Bhattacharyya against all
+references at once with a few matrix products instead of one
+cv2.compareHist call per pair. Every metric only depends on the bins
+where the query is non-zero (plus per-reference sums kept at insert
+time), so only those matrix rows are read; with the bins-first layout
+they are contiguous. Scores follow cv2.compareHist's formulas with the
+query as the first histogram and, for same-size images, agree with the
+pairwise results up to float32 rounding (which the square root of
+Bhattacharyya amplifies to ~1e-4 for near-identical histograms).
+References are stored at their native size while /api/compare resizes
+both images to a common size first, so for images of different sizes
+the scores differ.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+HIST_BINS = [50, 60]
+HIST_RANGES = [0, 180, 0, 256]
+HIST_SIZE = HIST_BINS[0] * HIST_BINS[1]
+
+# Metric -> True if higher scores mean more similar
+HIST_METRICS = {
+    'correlation': True,
+    'chi_square': False,
+    'intersection': True,
+    'bhattacharyya': False
+}
+
+# References scored per block, bounds the float32 temporaries
+BLOCK_COLUMNS = 4096
+
+# Same guards as cv2.compareHist
+DBL_EPSILON = np.finfo(np.float64).eps
+FLT_EPSILON = np.finfo(np.float32).eps
+
+
+def hs_histogram(hsv):
+    """Min-max normalized 50x60 H-S histogram of an HSV image (float32)."""
+    hist = cv2.calcHist([hsv], [0, 1], None, HIST_BINS, HIST_RANGES)
+    cv2.normalize(hist, hist, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX)
+    return hist
+
+
+def compare_histograms(query, columns, sums=None, squares=None):
+    """
+    All four cv2.compareHist metrics of `query` (first histogram) against
+    every column of `columns` (HIST_SIZE x N). `sums` and `squares` are the
+    per-column sums and sums of squares if already known.
+    Returns {metric: float64 array of N}.
+    """
+    q = np.asarray(query, dtype=np.float32).ravel()
+    columns = np.asarray(columns, dtype=np.float32).reshape(q.size, -1)
+    if sums is None:
+        sums = columns.sum(axis=0, dtype=np.float64)
+    if squares is None:
+        squares = np.einsum('ij,ij->j', columns, columns, dtype=np.float64)
+    n = q.size
+    count = columns.shape[1]
+
+    q_sum = q.sum(dtype=np.float64)
+    q_mean = q_sum / n
+    q_var = float(np.dot(q, q)) - q_sum * q_sum / n
+    # Bins where q == 0 add nothing to chi-square (skipped by OpenCV),
+    # intersection (min is 0) or Bhattacharyya (sqrt(q h) is 0)
+    support = np.flatnonzero(np.abs(q) > DBL_EPSILON)
+    q_support = q[support]
+    q_weights = 1.0 / q_support
+    q_sqrt = np.sqrt(q_support)
+
+    # Correlation: sum (h - mh)(q - mq) = sum h q - mq sum h
+    # Bhattacharyya: sqrt(1 - sum sqrt(q h) / sqrt(sum q * sum h))
+    row_var = squares - sums * sums / n
+    denominator = row_var * q_var
+    product = sums * q_sum
+    scores = {metric: np.empty(count) for metric in HIST_METRICS}
+    for start in range(0, count, BLOCK_COLUMNS):
+        end = min(start + BLOCK_COLUMNS, count)
+        block = columns[support, start:end]
+
+        covariance = q_support @ block - q_mean * sums[start:end]
+        correlation = np.ones(end - start)
+        valid = denominator[start:end] > DBL_EPSILON
+        correlation[valid] = covariance[valid] / np.sqrt(denominator[start:end][valid])
+        scores['correlation'][start:end] = correlation
+
+        scores['intersection'][start:end] = np.minimum(block, q_support[:, None]).sum(axis=0)
+
+        overlap = q_sqrt @ np.sqrt(block)
+        scale = np.ones(end - start)
+        valid = np.abs(product[start:end]) > FLT_EPSILON
+        scale[valid] = 1.0 / np.sqrt(product[start:end][valid])
+        scores['bhattacharyya'][start:end] = np.sqrt(np.maximum(1.0 - overlap * scale, 0.0))
+
+        # Chi-square: sum (q - h)^2 / q over the support
+        block -= q_support[:, None]
+        block *= block
+        scores['chi_square'][start:end] = q_weights @ block
+    return scores
+
+
+class HistogramIndex:
+    """
+    In-memory corpus of H-S histograms, one column per reference in a
+    contiguous float32 matrix (grown by doubling). Thread-safe; references
+    are identified by id.
+    """
+
+    def __init__(self, capacity=256):
+        self._capacity = capacity
+        self._allocate(capacity)
+        self.references = []
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def _allocate(self, capacity):
+        self._matrix = np.empty((HIST_SIZE, capacity), dtype=np.float32)
+        self._sums = np.empty(capacity)
+        self._squares = np.empty(capacity)
+
+    def register(self, reference_id, name, hsv):
+        """Store the histogram of an HSV image (idempotent per id). Returns (reference, created)."""
+        with self._lock:
+            column = self._columns.get(reference_id)
+            if column is not None:
+                return self.references[column], False
+        hist = hs_histogram(hsv).ravel()
+        with self._lock:
+            column = self._columns.get(reference_id)
+            if column is not None:
+                return self.references[column], False
+            column = len(self.references)
+            if column == self._matrix.shape[1]:
+                matrix, sums, squares = self._matrix, self._sums, self._squares
+                self._allocate(2 * column)
+                self._matrix[:, :column] = matrix
+                self._sums[:column] = sums
+                self._squares[:column] = squares
+            self._matrix[:, column] = hist
+            self._sums[column] = hist.sum(dtype=np.float64)
+            self._squares[column] = np.dot(hist.astype(np.float64), hist)
+            reference = {'id': reference_id, 'name': name}
+            self.references.append(reference)
+            self._columns[reference_id] = column
+            return reference, True
+
+    def query(self, hsv, metric='correlation', top_k=5):
+        """
+        Rank the references by `metric` against the histogram of an HSV image.
+        Returns [(reference, {metric: score}), ...], best first.
+        """
+        if metric not in HIST_METRICS:
+            raise ValueError(f"Unknown histogram metric '{metric}'. Choose from {', '.join(HIST_METRICS)}")
+        hist = hs_histogram(hsv)
+        with self._lock:
+            count = len(self.references)
+            # Columns are only ever appended (growing and clearing allocate
+            # new arrays), so these views stay valid outside the lock
+            columns = self._matrix[:, :count]
+            sums, squares = self._sums[:count], self._squares[:count]
+            references = self.references[:count]
+        if not count:
+            return []
+
+        scores = compare_histograms(hist, columns, sums, squares)
+        order = -scores[metric] if HIST_METRICS[metric] else scores[metric]
+        top_k = min(top_k, count)
+        best = np.argpartition(order, top_k - 1)[:top_k]
+        best = best[np.argsort(order[best], kind='stable')]
+        return [
+            (references[i], {name: float(values[i]) for name, values in scores.items()})
+            for i in best
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._allocate(self._capacity)
+            self.references = []
+            self._columns.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'references': len(self.references),
+                'bytes': len(self.references) * HIST_SIZE * 4
+            }
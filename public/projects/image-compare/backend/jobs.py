@@ -0,0 +1,368 @@
+"""
+Background Jobs
+Author: Kevin Hintermaier
+
+Asynchronous execution of comparisons that take longer than an HTTP
+request should (tiled SSIM of huge scans, scale/rotation sweeps, batch
+matrices), without an external broker.
+
+- JobManager keeps an in-memory job table and runs jobs on a local
+  process pool, separate from the threads that serve interactive
+  requests. Worker processes run at lower CPU priority and with a single
+  OpenCV thread each, so /api/compare keeps its cores.
+- The number of queued + running jobs is bounded; submit() raises
+  JobQueueFull beyond that instead of growing an unbounded backlog.
+- Workers report progress (0..1) through a multiprocessing queue. Every
+  running job owns a slot in a shared flag array; cancel() sets the flag
+  and the job stops at its next progress report.
+- Finished jobs and their results are dropped after `ttl` seconds.
+
+The job kinds at the bottom are plain functions of raw image bytes and
+options, so they can be pickled to the workers and also called directly.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from batch import BATCH_METRICS, baseline_scores, common_size, matrix_scores
+from matching import match_sweep
+from tiled import DEFAULT_TILE_SIZE, tiled_ssim
+from workers import submit_restarting
+
+JOB_STATES = ('queued', 'running', 'cancelling', 'done', 'failed', 'cancelled')
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when the job queue has no free slot."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled."""
+
+
+# ========================================
+# Worker Side
+# ========================================
+
+_worker = {}
+
+
+def _init_worker(cancel_flags, progress_queue, opencv_threads, nice):
+    _worker.update(cancel_flags=cancel_flags, progress_queue=progress_queue)
+    cv2.setNumThreads(opencv_threads)
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+def _run_job(job_id, slot, kind, args):
+    """Entry point in the worker process."""
+    cancel_flags = _worker['cancel_flags']
+    progress_queue = _worker['progress_queue']
+    last = [0.0]
+
+    def progress(fraction):
+        if cancel_flags[slot]:
+            raise JobCancelled()
+        # Throttled to whole percents
+        if fraction - last[0] >= 0.01 or fraction >= 1:
+            last[0] = fraction
+            progress_queue.put(('progress', job_id, fraction))
+
+    progress_queue.put(('started', job_id, 0.0))
+    if cancel_flags[slot]:
+        raise JobCancelled()
+    return JOB_KINDS[kind](*args, progress=progress)
+
+
+# ========================================
+# Job Table
+# ========================================
+
+class JobManager:
+    """
+    In-memory job table in front of a process pool (started lazily on the
+    first submit). Thread-safe.
+    """
+
+    def __init__(self, workers, max_queued, ttl, opencv_threads=1, nice=10):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.opencv_threads = opencv_threads
+        self.nice = nice
+        self._context = multiprocessing.get_context('spawn')
+        self._executor = None
+        self._cancel_flags = None
+        self._progress_queue = None
+        self._jobs = {}
+        self._free_slots = list(range(workers + max_queued))
+        # Reentrant: cancelling a queued future runs _finish() right away
+        self._lock = threading.RLock()
+
+    def _start(self):
+        """Start the pool and the progress listener (under the lock)."""
+        if self._progress_queue is None:
+            self._cancel_flags = self._context.RawArray('b', self.workers + self.max_queued)
+            self._progress_queue = self._context.Queue()
+            threading.Thread(target=self._listen, name='job-progress', daemon=True).start()
+        self._executor = ProcessPoolExecutor(
+            self.workers, mp_context=self._context, initializer=_init_worker,
+            initargs=(self._cancel_flags, self._progress_queue, self.opencv_threads, self.nice)
+        )
+        return self._executor
+
+    def _listen(self):
+        while True:
+            try:
+                event, job_id, fraction = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if event == 'started' and job['status'] == 'queued':
+                    job['status'] = 'running'
+                    job['started'] = time.time()
+                elif event == 'progress' and job['status'] in ('running', 'cancelling'):
+                    job['progress'] = max(job['progress'], fraction)
+
+    def submit(self, kind, *args):
+        """Queue a job of `kind` (see JOB_KINDS) and return its status."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'. Choose from {', '.join(JOB_KINDS)}")
+        with self._lock:
+            self._purge()
+            if not self._free_slots:
+                raise JobQueueFull(f'At most {self.workers + self.max_queued} jobs can be queued or running')
+            slot = self._free_slots.pop()
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'progress': 0.0,
+                'created': time.time(),
+                'started': None,
+                'finished': None,
+                'error': None,
+                'slot': slot,
+                'future': None,
+                'result': None
+            }
+            self._jobs[job_id] = job
+            try:
+                if self._executor is None:
+                    self._start()
+                self._cancel_flags[slot] = 0
+                future = submit_restarting(self._executor, self._start, _run_job, job_id, slot, kind, args)
+            except BaseException:
+                del self._jobs[job_id]
+                self._free_slots.append(slot)
+                raise
+            job['future'] = future
+            status = self._view(job)
+        future.add_done_callback(lambda done: self._finish(job_id, done))
+        return status
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            try:
+                job['result'] = future.result()
+                job['status'] = 'done'
+                job['progress'] = 1.0
+            except (CancelledError, JobCancelled):
+                job['status'] = 'cancelled'
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e) or type(e).__name__
+            job['finished'] = time.time()
+            job['future'] = None
+            self._free_slots.append(job['slot'])
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns its status or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            future = job['future']
+            if future is not None and job['status'] in ('queued', 'running'):
+                self._cancel_flags[job['slot']] = 1
+                if not future.cancel():
+                    job['status'] = 'cancelling'
+            return self._view(job)
+
+    def status(self, job_id):
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            return None if job is None else self._view(job)
+
+    def result(self, job_id):
+        """Return (status, result); result is None until the job is done."""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None, None
+            return self._view(job), job['result']
+
+    def list(self):
+        with self._lock:
+            self._purge()
+            return [self._view(job) for job in self._jobs.values()]
+
+    def stats(self):
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+            return {
+                'workers': self.workers,
+                'capacity': self.workers + self.max_queued,
+                'jobs': counts
+            }
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        Cancel queued jobs and stop the pool. Running jobs finish if `wait`,
+        or stop at their next progress report with `cancel`.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if cancel:
+                for job in self._jobs.values():
+                    if job['future'] is not None:
+                        self._cancel_flags[job['slot']] = 1
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _purge(self):
+        """Drop finished jobs older than the TTL (under the lock)."""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished'] is not None and now - job['finished'] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _view(self, job):
+        view = {key: job[key] for key in ('id', 'kind', 'status', 'progress', 'created', 'started', 'finished')}
+        if job['error'] is not None:
+            view['error'] = job['error']
+        if job['finished'] is not None:
+            view['expires'] = job['finished'] + self.ttl
+        return view
+
+
+# ========================================
+# Job Kinds
+# ========================================
+
+def _decode(buffer, name):
+    img = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f'Failed to decode {name}')
+    return img
+
+
+def _gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def ssim_job(image1, image2, window='box', tile_size=DEFAULT_TILE_SIZE, progress=None):
+    """SSIM of two images (resized to a common size), always tiled."""
+    img1, img2 = _decode(image1, 'image1'), _decode(image2, 'image2')
+    h, w = common_size([img1, img2])
+    gray = [_gray(img if img.shape[:2] == (h, w) else cv2.resize(img, (w, h))) for img in (img1, img2)]
+    del img1, img2
+    score, _ = tiled_ssim(gray[0], gray[1], window, tile_size or DEFAULT_TILE_SIZE, progress=progress)
+    return {
+        'score': float(score),
+        'interpretation': 'identical' if score > 0.95 else 'similar' if score > 0.8 else 'different',
+        'size': {'width': w, 'height': h}
+    }
+
+
+def compare_batch_job(images, baseline=None, metrics=None, window='box', tile_size='auto',
+                      tiling=(DEFAULT_TILE_SIZE, 16_000_000), progress=None):
+    """
+    Batch comparison (see batch.py) with the /api/compare/batch response
+    layout. tile_size='auto' tiles with tiling[0] above tiling[1] pixels.
+    """
+    metrics = list(metrics or BATCH_METRICS)
+    decoded = [_decode(buffer, f'image {index}') for index, buffer in enumerate(images)]
+    if baseline is not None:
+        baseline = _decode(baseline, 'baseline')
+    count = len(decoded)
+    if tile_size == 'auto':
+        h, w = common_size(decoded if baseline is None else [baseline, *decoded])
+        tile_size = tiling[0] if h * w > tiling[1] else 0
+    if baseline is None:
+        (height, width), pairs = matrix_scores(decoded, metrics, window=window, tile_size=tile_size)
+        total = count + count * (count - 1) // 2
+        results = {metric: np.empty((count, count)) for metric in metrics}
+    else:
+        (height, width), pairs = baseline_scores(baseline, decoded, metrics, window=window, tile_size=tile_size)
+        total = count
+        results = {metric: np.empty(count) for metric in metrics}
+
+    for done, (key, values) in enumerate(pairs, 1):
+        for metric, value in values.items():
+            if baseline is None:
+                i, j = key
+                results[metric][i, j] = results[metric][j, i] = value
+            else:
+                results[metric][key] = value
+        if progress is not None:
+            progress(done / total)
+
+    return {
+        'mode': 'matrix' if baseline is None else 'baseline',
+        'count': count,
+        'scores': {metric: BATCH_METRICS[metric] for metric in metrics},
+        'size': {'width': width, 'height': height},
+        'results': {metric: values.tolist() for metric, values in results.items()}
+    }
+
+
+def template_sweep_job(source, template, scales, angles, search='exhaustive', stop_confidence=0.95,
+                       engine='auto', progress=None):
+    """Scale/rotation sweep of one template, with the /api/template-match `match` layout."""
+    gray_source = _gray(_decode(source, 'source image'))
+    gray_template = _gray(_decode(template, 'template'))
+    found = match_sweep(gray_source, gray_template, scales, angles, search, stop_confidence,
+                        engine=engine, progress=progress)
+    if found is None:
+        raise ValueError('Template does not fit into the source image at any requested scale')
+    confidence, (x, y), used, (width, height), scale, angle, tried = found
+    return {
+        'match': {
+            'confidence': float(confidence),
+            'location': {'x': int(x), 'y': int(y), 'width': int(width), 'height': int(height)},
+            'search': search,
+            'engine': used,
+            'scale': scale,
+            'angle': angle,
+            'candidates_tried': tried
+        }
+    }
+
+
+JOB_KINDS = {
+    'ssim': ssim_job,
+    'compare_batch': compare_batch_job,
+    'template_sweep': template_sweep_job
+}
@@ -0,0 +1,407 @@
+"""
+Template Matching
+Author: Kevin Hintermaier
+
+Normalized cross-correlation (TM_CCOEFF_NORMED) search of a grayscale
+template in a grayscale source.
+
+- exhaustive: cv2.matchTemplate over the full-resolution source
+- pyramid: coarse-to-fine search. Source and template are reduced with
+  cv2.pyrDown until the template is about MIN_PYRAMID_TEMPLATE pixels on
+  its short side, the best few peaks of the coarse response map become
+  candidates, and each candidate is refined at full resolution in a small
+  window around its up-scaled position.
+
+TM_CCOEFF_NORMED is normalized per placement, so a refinement window
+returns the values of the full response map at those positions (up to
+OpenCV's float32 rounding, which reaches ~1e-2 on flat UI templates).
+The pyramid result therefore equals the exhaustive one whenever the true
+peak lies in one of the candidate windows. verify_scenarios.py checks
+location and confidence against the exhaustive search on the example
+scenarios; templates with little coarse structure (thin text, repeated
+widgets) can still be missed, which is why the mode is opt-in.
+
+PreparedSource holds what can be shared when many templates are searched
+in the same source (the batch endpoint): the grayscale image and its
+reduced pyramid levels, built once on first use.
+
+match_all() returns every occurrence above a confidence threshold from a
+single full-resolution response map: local maxima are extracted with
+cv2.dilate and overlapping boxes are removed by non-maximum suppression
+on a vectorized IoU matrix.
+
+match_sweep() tolerates DPI/zoom changes and small rotations by matching
+resized (and rotated, masked) copies of the template against the same
+PreparedSource. Candidates closest to the original template run first and
+the sweep stops early once a match reaches `stop_confidence`.
+
+Full response maps come from one of two engines:
+- spatial: cv2.matchTemplate. OpenCV already correlates large templates
+  with a block-wise DFT, but it transforms the source blocks on every call.
+- fft: the source spectrum (padded to an optimal DFT size) and its sum /
+  squared-sum integrals are computed once per PreparedSource, which the
+  app caches next to the decoded image. A match then costs one template
+  DFT, a spectrum product, one inverse DFT and the normalization.
+With engine='auto' FFT is chosen only when the template spans more than
+FFT_MIN_COVERAGE of the source in both directions (half-page document
+templates). Measured with one OpenCV thread on 512-2048 px sources, that
+is where cv2.matchTemplate switches to whole-source blocks and gets about
+twice as slow, and the FFT engine wins by 5-15% with a cached spectrum.
+Below it OpenCV's blocks are smaller than the whole-source DFT and
+spatial is 1.5-3x faster (e.g. 31 ms vs 88 ms for the 150 px template of
+example-security-source.png).
+"""
+
+import math
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+
+SEARCH_MODES = ('exhaustive', 'pyramid')
+
+# Short side of the template at the coarsest level
+MIN_PYRAMID_TEMPLATE = 24
+MAX_PYRAMID_LEVELS = 4
+
+# Coarse peaks refined at full resolution
+PYRAMID_CANDIDATES = 5
+
+ENGINES = ('auto', 'spatial', 'fft')
+
+# engine='auto' uses FFT when the template covers more than this fraction
+# of the source in both directions
+FFT_MIN_COVERAGE = 0.5
+
+# Multi-instance search: boxes overlapping a better match by more than
+# NMS_OVERLAP (IoU) are suppressed; only the best MAX_PEAK_CANDIDATES
+# local maxima enter the suppression step
+NMS_OVERLAP = 0.3
+MAX_PEAK_CANDIDATES = 1000
+
+
+class PreparedSource:
+    """
+    A grayscale source image prepared for repeated template searches.
+    Thread-safe: templates may be matched against it concurrently.
+    """
+
+    def __init__(self, gray):
+        self.gray = gray
+        self.shape = gray.shape
+        self.dft_shape = (cv2.getOptimalDFTSize(gray.shape[0]), cv2.getOptimalDFTSize(gray.shape[1]))
+        self._levels = [gray]
+        self._spectrum = None
+        self._integrals = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Upper bound of the memory held once levels, spectrum and integrals exist."""
+        h, w = self.shape[:2]
+        dft_h, dft_w = self.dft_shape
+        return self.gray.nbytes * 4 // 3 + dft_h * dft_w * 8 + (h + 1) * (w + 1) * 16
+
+    def spectrum(self):
+        """Complex DFT of the zero-padded float32 source (cached)."""
+        with self._lock:
+            if self._spectrum is None:
+                padded = np.zeros(self.dft_shape, np.float32)
+                padded[:self.shape[0], :self.shape[1]] = self.gray
+                self._spectrum = cv2.dft(padded, flags=cv2.DFT_COMPLEX_OUTPUT)
+            return self._spectrum
+
+    def integrals(self):
+        """Sum and squared-sum integral images in float64 (cached)."""
+        with self._lock:
+            if self._integrals is None:
+                self._integrals = cv2.integral2(self.gray, sdepth=cv2.CV_64F)
+            return self._integrals
+
+    def level(self, n):
+        """The source reduced n times with cv2.pyrDown (cached)."""
+        with self._lock:
+            while len(self._levels) <= n:
+                self._levels.append(cv2.pyrDown(self._levels[-1]))
+            return self._levels[n]
+
+
+def prepare_source(source):
+    """Wrap a grayscale ndarray in a PreparedSource (no-op if already prepared)."""
+    return source if isinstance(source, PreparedSource) else PreparedSource(source)
+
+
+def choose_engine(source, template_shape):
+    """Pick 'spatial' or 'fft' for a full response map (see FFT_MIN_COVERAGE)."""
+    sh, sw = source.shape[:2]
+    th, tw = template_shape[:2]
+    if th > FFT_MIN_COVERAGE * sh and tw > FFT_MIN_COVERAGE * sw:
+        return 'fft'
+    return 'spatial'
+
+
+def ncc_fft(source, gray_template):
+    """
+    TM_CCOEFF_NORMED response map computed with the cached source spectrum.
+
+    The zero-mean template is correlated in the frequency domain; the
+    per-window source variance comes from the cached integrals. Windows
+    without variance score 0.
+    """
+    source = prepare_source(source)
+    sh, sw = source.shape[:2]
+    th, tw = gray_template.shape[:2]
+    n = th * tw
+
+    template = gray_template.astype(np.float32)
+    template -= template.mean()
+    template_norm = math.sqrt(float(np.square(template, dtype=np.float64).sum()))
+
+    padded = np.zeros(source.dft_shape, np.float32)
+    padded[:th, :tw] = template
+    template_spectrum = cv2.dft(padded, flags=cv2.DFT_COMPLEX_OUTPUT, nonzeroRows=th)
+    product = cv2.mulSpectrums(source.spectrum(), template_spectrum, 0, conjB=True)
+    # The padded size is at least the source size, so valid positions never wrap around
+    numerator = cv2.idft(product, flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)[:sh - th + 1, :sw - tw + 1]
+
+    sums, squares = source.integrals()[:2]
+    window_sum = sums[th:, tw:] - sums[:-th, tw:] - sums[th:, :-tw] + sums[:-th, :-tw]
+    window_sq = squares[th:, tw:] - squares[:-th, tw:] - squares[th:, :-tw] + squares[:-th, :-tw]
+    variance = window_sq - window_sum * window_sum / n
+    denominator = np.sqrt(np.maximum(variance, 0)) * template_norm
+
+    res = np.zeros(numerator.shape, np.float32)
+    np.divide(numerator, denominator, out=res, where=denominator > 1e-3 * max(template_norm, 1e-6))
+    return res
+
+
+def response_map(source, gray_template, engine='auto'):
+    """Full TM_CCOEFF_NORMED response map. Returns (res, engine used)."""
+    source = prepare_source(source)
+    if engine == 'auto':
+        engine = choose_engine(source, gray_template.shape)
+    if engine == 'fft':
+        return ncc_fft(source, gray_template), engine
+    return cv2.matchTemplate(source.gray, gray_template, cv2.TM_CCOEFF_NORMED), 'spatial'
+
+
+def match_exhaustive(source, gray_template, engine='auto'):
+    """Full-resolution search. Returns (confidence, (x, y) of the top-left corner, engine)."""
+    res, engine = response_map(source, gray_template, engine)
+    _, max_val, _, max_loc = cv2.minMaxLoc(res)
+    return max_val, max_loc, engine
+
+
+def pyramid_levels(template_shape):
+    """
+    Number of pyrDown steps that keep the template above MIN_PYRAMID_TEMPLATE.
+    The source needs no check: pyrDown rounds sizes up, so a template that
+    fits the source still fits at every level.
+    """
+    levels = 0
+    side = min(template_shape[:2])
+    while levels < MAX_PYRAMID_LEVELS and side // 2 >= MIN_PYRAMID_TEMPLATE:
+        side //= 2
+        levels += 1
+    return levels
+
+
+def _coarse_peaks(res, count, suppress):
+    """Best `count` peaks of a response map, each suppressing a (h, w) neighborhood."""
+    res = res.copy()
+    h, w = suppress
+    peaks = []
+    for _ in range(count):
+        _, max_val, _, (x, y) = cv2.minMaxLoc(res)
+        if peaks and max_val <= -1:
+            break
+        peaks.append((x, y))
+        res[max(0, y - h):y + h + 1, max(0, x - w):x + w + 1] = -2
+    return peaks
+
+
+def match_pyramid(source, gray_template, candidates=PYRAMID_CANDIDATES):
+    """
+    Coarse-to-fine search. Returns (confidence, (x, y), engine) like
+    match_exhaustive(); the reduced maps and windows are always spatial.
+    Templates too small for a pyramid fall back to the exhaustive search.
+    """
+    source = prepare_source(source)
+    levels = pyramid_levels(gray_template.shape)
+    if levels == 0:
+        return match_exhaustive(source, gray_template)
+
+    template = gray_template
+    for _ in range(levels):
+        template = cv2.pyrDown(template)
+    res = cv2.matchTemplate(source.level(levels), template, cv2.TM_CCOEFF_NORMED)
+    th_coarse, tw_coarse = template.shape[:2]
+    peaks = _coarse_peaks(res, candidates, (th_coarse // 2, tw_coarse // 2))
+
+    # pyrDown rounding and blur move a peak by up to ~1 coarse pixel
+    scale = 2 ** levels
+    margin = 2 * scale
+    gray_source = source.gray
+    sh, sw = gray_source.shape[:2]
+    th, tw = gray_template.shape[:2]
+    best_val, best_loc = -2.0, (0, 0)
+    for x, y in peaks:
+        x0 = max(0, x * scale - margin)
+        y0 = max(0, y * scale - margin)
+        x1 = min(sw, x * scale + margin + tw)
+        y1 = min(sh, y * scale + margin + th)
+        window = cv2.matchTemplate(gray_source[y0:y1, x0:x1], gray_template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, (wx, wy) = cv2.minMaxLoc(window)
+        if max_val > best_val:
+            best_val, best_loc = max_val, (x0 + wx, y0 + wy)
+    return best_val, best_loc, 'spatial'
+
+
+def find_peaks(res, template_shape, min_confidence, max_results, overlap=NMS_OVERLAP):
+    """
+    Non-maximum suppressed peaks of a TM_CCOEFF_NORMED response map.
+    Returns up to `max_results` (confidence, (x, y)) tuples, best first.
+    """
+    local_max = cv2.dilate(res, np.ones((3, 3), np.uint8))
+    ys, xs = np.nonzero((res >= local_max) & (res >= min_confidence))
+    scores = res[ys, xs]
+    order = np.argsort(-scores, kind='stable')[:MAX_PEAK_CANDIDATES]
+    xs, ys, scores = xs[order], ys[order], scores[order]
+
+    # All boxes have the template's size, so their IoU only depends on the offsets
+    th, tw = template_shape[:2]
+    ix = np.clip(tw - np.abs(xs[:, None] - xs[None, :]), 0, None)
+    iy = np.clip(th - np.abs(ys[:, None] - ys[None, :]), 0, None)
+    intersection = ix * iy
+    iou = intersection / (2 * tw * th - intersection)
+
+    keep = []
+    suppressed = np.zeros(len(scores), dtype=bool)
+    for i in range(len(scores)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if len(keep) == max_results:
+            break
+        suppressed |= iou[i] > overlap
+    return [(float(scores[i]), (int(xs[i]), int(ys[i]))) for i in keep]
+
+
+def match_all(source, gray_template, min_confidence, max_results, engine='auto'):
+    """
+    Multi-instance search over the full-resolution response map.
+    Returns (confidence, (x, y), engine, peaks): the best match as in
+    match_exhaustive() plus every non-overlapping peak >= min_confidence.
+    """
+    res, engine = response_map(source, gray_template, engine)
+    _, max_val, _, max_loc = cv2.minMaxLoc(res)
+    return max_val, max_loc, engine, find_peaks(res, gray_template.shape, min_confidence, max_results)
+
+
+def transform_template(gray_template, scale, angle):
+    """
+    Resize and rotate a template. Returns (template, mask); the mask marks
+    the pixels of the rotated template inside its bounding box and is
+    None when there is no rotation.
+    """
+    th, tw = gray_template.shape[:2]
+    if scale != 1:
+        size = (max(1, round(tw * scale)), max(1, round(th * scale)))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        gray_template = cv2.resize(gray_template, size, interpolation=interpolation)
+        th, tw = gray_template.shape[:2]
+    if angle == 0:
+        return gray_template, None
+
+    # Rotate about the center into a canvas that holds the whole template
+    rotation = cv2.getRotationMatrix2D((tw / 2, th / 2), angle, 1.0)
+    cos, sin = abs(rotation[0, 0]), abs(rotation[0, 1])
+    bw, bh = int(math.ceil(th * sin + tw * cos)), int(math.ceil(th * cos + tw * sin))
+    rotation[0, 2] += bw / 2 - tw / 2
+    rotation[1, 2] += bh / 2 - th / 2
+    rotated = cv2.warpAffine(gray_template, rotation, (bw, bh), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpAffine(np.full((th, tw), 255, np.uint8), rotation, (bw, bh), flags=cv2.INTER_NEAREST)
+    return rotated, mask
+
+
+def match_sweep(source, gray_template, scales=(1.0,), angles=(0,), search='exhaustive',
+                stop_confidence=0.95, executor=None, engine='auto', progress=None):
+    """
+    Search the template at several scales and rotation angles.
+
+    Candidates are ordered by distance from (scale 1, angle 0) and matched
+    on `executor` if given. Once a candidate reaches `stop_confidence` the
+    remaining ones are cancelled. Returns (confidence, (x, y), engine,
+    (w, h), scale, angle, tried) of the best candidate, or None if no
+    transformed template fits into the source. Rotated (masked) templates
+    always use the spatial engine. `progress` is called with the fraction
+    of candidates tried after each one.
+    """
+    source = prepare_source(source)
+    sh, sw = source.shape[:2]
+    candidates = sorted(
+        ((scale, angle) for scale in scales for angle in angles),
+        key=lambda candidate: (abs(math.log(candidate[0])), abs(candidate[1]))
+    )
+
+    def run(candidate):
+        scale, angle = candidate
+        template, mask = transform_template(gray_template, scale, angle)
+        th, tw = template.shape[:2]
+        if th > sh or tw > sw or min(th, tw) < 8:
+            return None
+        if mask is None:
+            confidence, loc, used = match_template(source, template, search, engine)
+        else:
+            res = cv2.matchTemplate(source.gray, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+            # Masked correlation of flat regions yields inf/nan
+            res[~np.isfinite(res)] = -1
+            _, confidence, _, loc = cv2.minMaxLoc(res)
+            used = 'spatial'
+        return confidence, loc, used, (tw, th), scale, angle
+
+    best = None
+    tried = 0
+
+    def consider(result):
+        nonlocal best, tried
+        tried += 1
+        if result is not None and (best is None or result[0] > best[0]):
+            best = result
+        if progress is not None:
+            progress(tried / len(candidates))
+        return best is not None and best[0] >= stop_confidence
+
+    if executor is None:
+        for candidate in candidates:
+            if consider(run(candidate)):
+                break
+    else:
+        # Queued candidates are cancelled once a confident match is found
+        running = [executor.submit(run, candidate) for candidate in candidates]
+        try:
+            while running:
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                running = [future for future in running if future in not_done]
+                if any([consider(future.result()) for future in done]):
+                    break
+        finally:
+            for future in running:
+                future.cancel()
+
+    if best is None:
+        return None
+    return (*best, tried)
+
+
+def match_template(source, gray_template, search='exhaustive', engine='auto'):
+    """
+    Dispatch to the requested search mode. `source` is a grayscale ndarray
+    or a PreparedSource. Returns (confidence, (x, y), engine).
+    """
+    if search == 'pyramid':
+        return match_pyramid(source, gray_template)
+    if search == 'exhaustive':
+        return match_exhaustive(source, gray_template, engine)
+    raise ValueError(f"Unknown search '{search}'. Choose from {', '.join(SEARCH_MODES)}")
@@ -0,0 +1,150 @@
+"""
+Perceptual Hashing
+Author: Kevin Hintermaier
+
+64-bit fingerprints that stay (nearly) identical under re-encoding,
+resizing and small edits, for answering "is this basically the same
+image?" without running the full comparison pipeline.
+
+- ahash: 8x8 thumbnail, bit = pixel above the mean
+- dhash: 9x8 thumbnail, bit = pixel brighter than its left neighbor
+- phash: 8x8 lowest frequencies of the DCT of a 32x32 thumbnail,
+  bit = coefficient above their median
+
+HashIndex keeps registered hashes in memory and answers Hamming-radius
+queries with multi-index hashing: the 64 bits are split into 4 chunks of
+16 bits, and two hashes within distance r agree on at least one chunk up
+to r // 4 flipped bits. Only the buckets of those chunk neighbors are
+visited, and every candidate is verified with the full distance.
+"""
+
+import threading
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+HASH_KINDS = ('phash', 'dhash', 'ahash')
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Largest query radius; keeps the chunk neighborhood at <= 2517 lookups
+MAX_DISTANCE = 19
+
+
+def _pack(bits):
+    """Boolean array of 64 bits (row-major) -> unsigned int."""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def ahash(gray):
+    small = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return _pack(small > small.mean())
+
+
+def dhash(gray):
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray):
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    return _pack(low > np.median(low))
+
+
+HASH_FUNCTIONS = {'phash': phash, 'dhash': dhash, 'ahash': ahash}
+
+
+def image_hashes(gray):
+    """All perceptual hashes of a grayscale image, by kind."""
+    return {kind: function(gray) for kind, function in HASH_FUNCTIONS.items()}
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def hash_hex(value):
+    return f'{value:016x}'
+
+
+def _chunks(value):
+    return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _flip_masks(radius):
+    """All CHUNK_BITS-bit masks with at most `radius` bits set."""
+    masks = [0]
+    for count in range(1, radius + 1):
+        for positions in combinations(range(CHUNK_BITS), count):
+            masks.append(sum(1 << p for p in positions))
+    return masks
+
+
+class HashIndex:
+    """
+    In-memory multi-index hash table over the hashes of registered
+    references, one table per hash kind. Thread-safe.
+    """
+
+    def __init__(self):
+        self.references = {}
+        self._tables = {kind: [{} for _ in range(CHUNKS)] for kind in HASH_KINDS}
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def register(self, reference_id, name, gray):
+        """Hash and store a reference (idempotent per id). Returns (reference, created)."""
+        with self._lock:
+            existing = self.references.get(reference_id)
+            if existing is not None:
+                return existing, False
+        reference = {'id': reference_id, 'name': name, 'hashes': image_hashes(gray)}
+        with self._lock:
+            existing = self.references.get(reference_id)
+            if existing is not None:
+                return existing, False
+            self.references[reference_id] = reference
+            for kind, value in reference['hashes'].items():
+                for table, chunk in zip(self._tables[kind], _chunks(value)):
+                    table.setdefault(chunk, []).append(reference_id)
+            return reference, True
+
+    def query(self, value, kind='phash', max_distance=10):
+        """References whose `kind` hash lies within `max_distance`, closest first: [(reference, distance)]."""
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f'max_distance must be between 0 and {MAX_DISTANCE}')
+        masks = self._masks.get(max_distance // CHUNKS)
+        if masks is None:
+            masks = self._masks.setdefault(max_distance // CHUNKS, _flip_masks(max_distance // CHUNKS))
+
+        with self._lock:
+            candidates = set()
+            for table, chunk in zip(self._tables[kind], _chunks(value)):
+                for mask in masks:
+                    bucket = table.get(chunk ^ mask)
+                    if bucket:
+                        candidates.update(bucket)
+            found = []
+            for reference_id in candidates:
+                reference = self.references[reference_id]
+                distance = hamming(value, reference['hashes'][kind])
+                if distance <= max_distance:
+                    found.append((reference, distance))
+        found.sort(key=lambda item: (item[1], item[0]['name']))
+        return found
+
+    def clear(self):
+        with self._lock:
+            self.references.clear()
+            for tables in self._tables.values():
+                for table in tables:
+                    table.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'references': len(self.references)}
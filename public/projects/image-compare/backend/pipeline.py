@@ -0,0 +1,168 @@
+"""
+Stage Graph Pipeline
+Author: Kevin Hintermaier
+
+A tiny dataflow engine used by the comparison endpoints.
+
+Every stage declares the intermediates it consumes. A run only executes the
+stages needed for the requested targets, computes each intermediate exactly
+once and releases it as soon as no remaining stage needs it.
+
+iter_completed() maps a function over many work items (batch pairs,
+templates) and yields the results as they finish.
+"""
+
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+
+
+class Stage:
+    """A named processing step and the intermediates it consumes."""
+
+    def __init__(self, name, func, inputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs!r})"
+
+
+class Pipeline:
+    """
+    A graph of stages keyed by the name of the value they produce.
+
+    Values passed to run() directly (sources) take precedence over stages of
+    the same name, so e.g. already decoded images skip the decode stages.
+    """
+
+    def __init__(self, stages=()):
+        self.stages = {}
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        """Register a stage. Each value may only have one producer."""
+        if stage.name in self.stages:
+            raise ValueError(f"Stage '{stage.name}' is already declared")
+        self.stages[stage.name] = stage
+        return stage
+
+    def plan(self, targets, sources=()):
+        """Return the stages needed for `targets` in dependency order."""
+        order = []
+        state = {}
+
+        def visit(name):
+            if name in sources or state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Stage graph has a cycle through '{name}'")
+            stage = self.stages.get(name)
+            if stage is None:
+                raise KeyError(f"No stage or source provides '{name}'")
+            state[name] = 'visiting'
+            for dep in stage.inputs:
+                visit(dep)
+            state[name] = 'done'
+            order.append(stage)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def run(self, targets, executor=None, **sources):
+        """
+        Compute `targets` from `sources` and return them as a dict.
+
+        Intermediates that are not targets are dropped as soon as their
+        last consumer has run, which keeps peak memory close to the
+        working set of the widest stage instead of the whole graph.
+
+        With an `executor` (e.g. a ThreadPoolExecutor) independent stages
+        run concurrently as soon as their inputs are ready. Bookkeeping
+        stays on the calling thread; only stage functions run in workers.
+        """
+        plan = self.plan(targets, sources)
+        pending = Counter(dep for stage in plan for dep in stage.inputs)
+        keep = set(targets)
+        values = dict(sources)
+
+        def release(stage):
+            for dep in stage.inputs:
+                pending[dep] -= 1
+                if pending[dep] == 0 and dep not in keep:
+                    del values[dep]
+
+        if executor is None:
+            for stage in plan:
+                values[stage.name] = stage.func(*(values[dep] for dep in stage.inputs))
+                release(stage)
+            return {name: values[name] for name in targets}
+
+        waiting = {stage.name: sum(dep not in sources for dep in set(stage.inputs)) for stage in plan}
+        consumers = {}
+        for stage in plan:
+            for dep in set(stage.inputs):
+                consumers.setdefault(dep, []).append(stage)
+        running = {}
+
+        def submit(stage):
+            args = [values[dep] for dep in stage.inputs]
+            running[executor.submit(stage.func, *args)] = stage
+
+        try:
+            for stage in plan:
+                if waiting[stage.name] == 0:
+                    submit(stage)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    values[stage.name] = future.result()
+                    release(stage)
+                    for consumer in consumers.get(stage.name, ()):
+                        waiting[consumer.name] -= 1
+                        if waiting[consumer.name] == 0:
+                            submit(consumer)
+        except BaseException:
+            for future in running:
+                future.cancel()
+            raise
+
+        return {name: values[name] for name in targets}
+
+
+def iter_completed(executor, func, items, max_pending=16):
+    """
+    Yield (item, func(item)) for every item, in completion order.
+
+    Items are consumed lazily and at most `max_pending` (keep it above the
+    worker count) run or wait in the executor at once, so neither the work
+    list nor the results pile up when the consumer is slower. Without an
+    executor the items run one by one on the calling thread. Closing the
+    generator cancels the work that has not started yet.
+    """
+    items = iter(items)
+    if executor is None:
+        for item in items:
+            yield item, func(item)
+        return
+
+    running = {}
+
+    def submit(count):
+        for item in islice(items, count):
+            running[executor.submit(func, item)] = item
+
+    try:
+        submit(max_pending)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield running.pop(future), future.result()
+            submit(max_pending - len(running))
+    finally:
+        for future in running:
+            future.cancel()
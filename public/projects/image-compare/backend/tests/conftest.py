@@ -0,0 +1,12 @@
+"""
+Test setup: make the backend modules importable and keep the app's
+reference corpus out of backend/data.
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault('FEATURE_INDEX_DIR', tempfile.mkdtemp(prefix='image-compare-features-'))
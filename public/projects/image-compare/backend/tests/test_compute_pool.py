@@ -0,0 +1,68 @@
+"""
+The compute processes import compare.py, not the app, and return the same
+results as the in-process pipeline.
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+import pytest
+
+from app import TILING, compare_pipeline
+from compare import METRICS, VISUALIZATIONS
+from conftest import BACKEND_DIR
+from workers import ComputePool, submit_restarting
+
+
+def test_compare_module_has_no_app_state():
+    probe = "import sys, compare; print(sorted(m for m in ('app', 'cache', 'feature_index', 'jobs', 'flask') if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', probe], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
+
+
+@pytest.fixture
+def pool():
+    pool = ComputePool(1, ['compare'])
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_matches_in_process(pool):
+    rng = np.random.default_rng(0)
+    img1 = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    img2 = cv2.GaussianBlur(img1, (5, 5), 0)
+    targets, visualize = list(METRICS.values()), list(VISUALIZATIONS)
+    stage_options = {'canny_thresholds': (50, 150), 'diff_threshold': 30, 'ssim_window': 'box', 'tile_size': 64}
+
+    expected = compare_pipeline.run(targets + visualize, img1=img1, img2=img2, **stage_options)
+    outputs = {name: expected[name].nbytes for name in visualize}
+    results, rendered = pool.run('compare', {'img1': img1, 'img2': img2}, outputs, targets, visualize, stage_options, TILING)
+
+    assert results == {name: expected[name] for name in targets}
+    for name in visualize:
+        np.testing.assert_array_equal(rendered[name], expected[name])
+
+
+def test_submit_restarts_broken_pool():
+    context = multiprocessing.get_context('spawn')
+    pools = [ProcessPoolExecutor(1, mp_context=context)]
+
+    def start():
+        pools.append(ProcessPoolExecutor(1, mp_context=context))
+        return pools[-1]
+
+    try:
+        # A worker that dies breaks the whole pool
+        with pytest.raises(BrokenProcessPool):
+            pools[0].submit(os._exit, 1).result()
+        assert submit_restarting(pools[0], start, pow, 2, 3).result() == 8
+        assert len(pools) == 2
+    finally:
+        for pool in pools:
+            pool.shutdown()
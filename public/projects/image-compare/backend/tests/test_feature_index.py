@@ -0,0 +1,57 @@
+"""
+Opening a FeatureStore never modifies its files; leftovers of an
+interrupted registration are dropped before the next append.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from feature_index import DESCRIPTOR_BYTES, KEYPOINT_FIELDS, FeatureIndex, FeatureStore
+
+
+def textured(seed, shape=(120, 160)):
+    img = np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+
+def file_sizes(path):
+    return [os.path.getsize(os.path.join(path, name)) for name in ('descriptors.bin', 'keypoints.bin')]
+
+
+def test_open_does_not_truncate(tmp_path):
+    index = FeatureIndex(FeatureStore(str(tmp_path)))
+    index.register('a', 'a', textured(0))
+    # An interrupted (or concurrent) registration appended rows that
+    # references.json does not list yet
+    with open(tmp_path / 'descriptors.bin', 'ab') as f:
+        f.write(bytes(3 * DESCRIPTOR_BYTES))
+    with open(tmp_path / 'keypoints.bin', 'ab') as f:
+        f.write(bytes(3 * KEYPOINT_FIELDS * 4))
+    sizes = file_sizes(tmp_path)
+
+    reopened = FeatureStore(str(tmp_path))
+    assert file_sizes(tmp_path) == sizes
+    assert reopened.count == index.store.count
+
+
+def test_append_drops_trailing_rows(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    index = FeatureIndex(store)
+    first, _ = index.register('a', 'a', textured(0))
+    with open(tmp_path / 'descriptors.bin', 'ab') as f:
+        f.write(bytes(3 * DESCRIPTOR_BYTES))
+    with open(tmp_path / 'keypoints.bin', 'ab') as f:
+        f.write(bytes(3 * KEYPOINT_FIELDS * 4))
+
+    second, _ = index.register('b', 'b', textured(1))
+    assert second['start'] == first['count']
+    rows = store.count
+    assert file_sizes(tmp_path) == [rows * DESCRIPTOR_BYTES, rows * KEYPOINT_FIELDS * 4]
+
+    # Both references are found again after reopening
+    reopened = FeatureIndex(FeatureStore(str(tmp_path)))
+    for seed, reference_id in ((0, 'a'), (1, 'b')):
+        _, ranked = reopened.query(textured(seed))
+        assert ranked[0][0]['id'] == reference_id
@@ -0,0 +1,72 @@
+"""
+The vectorized histogram scores equal cv2.compareHist for same-size images.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from compare import histogram_stage
+from histogram_index import BLOCK_COLUMNS, HIST_METRICS, HistogramIndex, compare_histograms, hs_histogram
+
+# Bhattacharyya is sqrt(1 - x): near 0 the float32 rounding of x grows to ~1e-4
+TOLERANCE = {'bhattacharyya': 1e-3}
+
+METHODS = {
+    'correlation': cv2.HISTCMP_CORREL,
+    'chi_square': cv2.HISTCMP_CHISQR,
+    'intersection': cv2.HISTCMP_INTERSECT,
+    'bhattacharyya': cv2.HISTCMP_BHATTACHARYYA
+}
+
+
+def hsv_images(count, shape=(48, 64), seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        # Few colors per image, so the histograms are sparse like real photos
+        palette = rng.integers(0, 256, (3 + i % 5, 3), dtype=np.uint8)
+        labels = rng.integers(0, len(palette), shape)
+        images.append(cv2.cvtColor(palette[labels], cv2.COLOR_BGR2HSV))
+    return images
+
+
+def test_matches_compare_hist():
+    images = hsv_images(12)
+    histograms = [hs_histogram(hsv) for hsv in images]
+    columns = np.stack([hist.ravel() for hist in histograms], axis=1)
+    for query in histograms[:3]:
+        scores = compare_histograms(query, columns)
+        for metric, method in METHODS.items():
+            expected = [cv2.compareHist(query, hist, method) for hist in histograms]
+            np.testing.assert_allclose(scores[metric], expected, rtol=1e-4, atol=TOLERANCE.get(metric, 1e-5))
+
+
+def test_blocks_match_single_pass(monkeypatch):
+    histograms = [hs_histogram(hsv).ravel() for hsv in hsv_images(10, seed=1)]
+    columns = np.stack(histograms, axis=1)
+    expected = compare_histograms(histograms[0], columns)
+    monkeypatch.setattr('histogram_index.BLOCK_COLUMNS', 3)
+    blocked = compare_histograms(histograms[0], columns)
+    assert BLOCK_COLUMNS > 3
+    for metric in HIST_METRICS:
+        np.testing.assert_allclose(blocked[metric], expected[metric])
+
+
+@pytest.mark.parametrize('metric', list(HIST_METRICS))
+def test_index_query_matches_pairwise(metric):
+    images = hsv_images(20, seed=2)
+    # Starts small so registering grows the matrix
+    index = HistogramIndex(capacity=4)
+    for i, hsv in enumerate(images):
+        index.register(f'ref{i}', f'ref{i}', hsv)
+    query = images[7]
+
+    ranked = index.query(query, metric, top_k=5)
+    assert ranked[0][0]['id'] == 'ref7'
+    pairwise = [histogram_stage((query, images[int(ref['id'][3:])])) for ref, _ in ranked]
+    for (_, scores), expected in zip(ranked, pairwise):
+        for name in HIST_METRICS:
+            assert scores[name] == pytest.approx(expected[name], rel=1e-4, abs=TOLERANCE.get(name, 1e-5))
+    values = [scores[metric] for _, scores in ranked]
+    assert values == sorted(values, reverse=HIST_METRICS[metric])
@@ -0,0 +1,116 @@
+"""
+Template search engines: the FFT engine reproduces cv2.matchTemplate and
+engine='auto' keeps the example scenarios on the faster spatial engine.
+Multi-instance search finds repeated instances with either engine.
+"""
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from matching import PreparedSource, choose_engine, find_peaks, match_all, match_template, ncc_fft
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The scenarios of verify_scenarios.py
+SCENARIOS = [
+    ('example-security-source.png', 'example-security-template.png'),
+    ('example-ui-source.png', 'example-ui-template.png'),
+    ('example-fishing-scene.png', 'example-fishing-template.png'),
+]
+
+
+def load_gray(name):
+    return cv2.imread(os.path.join(PROJECT_DIR, name), cv2.IMREAD_GRAYSCALE)
+
+
+@pytest.mark.parametrize('source_file, template_file', SCENARIOS)
+def test_auto_picks_spatial_on_examples(source_file, template_file):
+    source = PreparedSource(load_gray(source_file))
+    template = load_gray(template_file)
+    # Even once the app's image cache holds the source spectrum
+    source.spectrum()
+    assert choose_engine(source, template.shape) == 'spatial'
+    assert match_template(source, template, engine='auto')[2] == 'spatial'
+
+
+def test_auto_picks_fft_for_large_templates():
+    source = np.zeros((1000, 800), np.uint8)
+    assert choose_engine(source, (501, 401)) == 'fft'
+    assert choose_engine(source, (501, 400)) == 'spatial'
+    assert choose_engine(source, (900, 300)) == 'spatial'
+
+
+@pytest.mark.parametrize('template_shape', [(16, 16), (40, 90), (150, 150), (330, 250)])
+def test_ncc_fft_matches_opencv(template_shape):
+    rng = np.random.default_rng(0)
+    source = cv2.GaussianBlur(rng.integers(0, 256, (400, 500), dtype=np.uint8), (5, 5), 0)
+    th, tw = template_shape
+    template = source[37:37 + th, 61:61 + tw].copy()
+
+    expected = cv2.matchTemplate(source, template, cv2.TM_CCOEFF_NORMED)
+    res = ncc_fft(PreparedSource(source), template)
+    assert res.shape == expected.shape
+    np.testing.assert_allclose(res, expected, atol=1e-3)
+    assert cv2.minMaxLoc(res)[3] == (61, 37)
+
+
+def test_ncc_fft_flat_windows_score_zero():
+    source = np.full((120, 160), 90, np.uint8)
+    source[40:80, 50:110] = np.random.default_rng(1).integers(0, 256, (40, 60), dtype=np.uint8)
+    template = source[40:60, 50:80].copy()
+    res = ncc_fft(PreparedSource(source), template)
+    # The top-left corner window is entirely flat
+    assert res[0, 0] == 0
+    assert cv2.minMaxLoc(res)[3] == (50, 40)
+
+
+def scene_with_instances(positions, size=(400, 600), seed=3):
+    """Noisy background with copies of one textured patch at (x, y) positions."""
+    rng = np.random.default_rng(seed)
+    scene = cv2.GaussianBlur(rng.integers(0, 256, size, dtype=np.uint8), (5, 5), 0)
+    patch = cv2.GaussianBlur(rng.integers(0, 256, (40, 50), dtype=np.uint8), (3, 3), 0)
+    for x, y in positions:
+        scene[y:y + 40, x:x + 50] = patch
+    return scene, patch
+
+
+INSTANCES = [(20, 30), (150, 40), (300, 200), (480, 320), (90, 250)]
+
+
+@pytest.mark.parametrize('engine', ['spatial', 'fft'])
+def test_match_all_finds_every_instance(engine):
+    scene, patch = scene_with_instances(INSTANCES)
+    confidence, loc, used, peaks = match_all(PreparedSource(scene), patch, 0.9, 100, engine)
+    assert used == engine
+    assert confidence == pytest.approx(1, abs=1e-3)
+    assert sorted(loc for _, loc in peaks) == sorted(INSTANCES)
+    scores = [score for score, _ in peaks]
+    assert scores == sorted(scores, reverse=True)
+
+
+@pytest.mark.parametrize('engine', ['spatial', 'fft'])
+def test_match_all_caps_results(engine):
+    scene, patch = scene_with_instances(INSTANCES)
+    peaks = match_all(PreparedSource(scene), patch, 0.9, 3, engine)[3]
+    assert len(peaks) == 3
+    assert all(loc in INSTANCES for _, loc in peaks)
+
+
+def test_nms_suppresses_overlapping_peaks():
+    res = np.zeros((100, 100), np.float32)
+    res[10, 10] = 0.95
+    # Shifted by 5 px: IoU with the 20x20 box at (10, 10) is 0.6
+    res[15, 15] = 0.9
+    # Shifted by 15 px horizontally only: IoU 0.14, kept
+    res[10, 25] = 0.85
+    res[60, 60] = 0.8
+    peaks = find_peaks(res, (20, 20), 0.5, 10)
+    assert [loc for _, loc in peaks] == [(10, 10), (25, 10), (60, 60)]
+    assert peaks[0][0] == pytest.approx(0.95)
+    # Lower threshold keeps the weaker peak out
+    assert [loc for _, loc in find_peaks(res, (20, 20), 0.82, 10)] == [(10, 10), (25, 10)]
+    # overlap=1 disables suppression
+    assert len(find_peaks(res, (20, 20), 0.5, 10, overlap=1.0)) == 4
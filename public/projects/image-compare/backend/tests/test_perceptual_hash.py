@@ -0,0 +1,61 @@
+"""
+HashIndex finds exactly the references a brute-force Hamming scan finds.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from perceptual_hash import HASH_BITS, HASH_KINDS, MAX_DISTANCE, HashIndex, hamming, image_hashes
+
+
+def textured(seed, shape=(64, 64)):
+    img = np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+    return cv2.GaussianBlur(img, (7, 7), 0)
+
+
+@pytest.fixture(scope='module')
+def index():
+    index = HashIndex()
+    for seed in range(60):
+        index.register(f'ref{seed}', f'ref{seed}', textured(seed))
+    return index
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << int(bit)
+    return value
+
+
+@pytest.mark.parametrize('kind', HASH_KINDS)
+@pytest.mark.parametrize('max_distance', [0, 3, 4, 10, MAX_DISTANCE])
+def test_query_matches_brute_force(index, kind, max_distance):
+    rng = np.random.default_rng(max_distance)
+    references = list(index.references.values())
+    for reference in references[:10]:
+        flips = rng.choice(HASH_BITS, rng.integers(0, max_distance + 2), replace=False)
+        value = flip(reference['hashes'][kind], flips)
+        expected = sorted(
+            (hamming(value, ref['hashes'][kind]), ref['name']) for ref in references
+            if hamming(value, ref['hashes'][kind]) <= max_distance
+        )
+        found = index.query(value, kind, max_distance)
+        assert [(distance, ref['name']) for ref, distance in found] == expected
+
+
+def test_resized_copy_is_near(index):
+    gray = textured(5)
+    value = image_hashes(cv2.resize(gray, (96, 96)))['phash']
+    found = index.query(value, 'phash', 10)
+    assert found[0][0]['id'] == 'ref5'
+
+
+def test_register_is_idempotent(index):
+    reference, created = index.register('ref0', 'other', textured(0))
+    assert not created and reference['name'] == 'ref0'
+
+
+def test_max_distance_bounds(index):
+    with pytest.raises(ValueError):
+        index.query(0, 'phash', MAX_DISTANCE + 1)
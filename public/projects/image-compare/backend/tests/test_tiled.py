@@ -0,0 +1,62 @@
+"""
+Tiled SSIM / difference agree with the untiled computation, including
+remainder tiles narrower than the SSIM window.
+"""
+
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from app import app
+from ssim import structural_similarity
+from tiled import iter_tiles, tiled_abs_diff, tiled_ssim
+
+
+def noisy_pair(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    gray1 = cv2.GaussianBlur(rng.integers(0, 256, shape, dtype=np.uint8), (5, 5), 0)
+    noise = rng.integers(-20, 21, shape)
+    gray2 = np.clip(gray1.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return gray1, gray2
+
+
+@pytest.mark.parametrize('window', ['box', 'gaussian'])
+@pytest.mark.parametrize('remainder', range(1, 8))
+def test_narrow_remainder_tiles(window, remainder):
+    # Last tile column and row are only `remainder` pixels wide
+    gray1, gray2 = noisy_pair((64 * 2 + remainder, 64 * 3 + remainder))
+    score, diff = tiled_ssim(gray1, gray2, window, tile_size=64)
+    expected, expected_map = structural_similarity(gray1, gray2, full=True, window=window)
+    assert score == pytest.approx(expected, abs=1e-6)
+    np.testing.assert_array_equal(diff, (expected_map * 255).astype(np.uint8))
+
+
+def test_reported_shape():
+    gray1, gray2 = noisy_pair((300, 1025))
+    score, _ = tiled_ssim(gray1, gray2, 'box', tile_size=64)
+    assert score == pytest.approx(structural_similarity(gray1, gray2), abs=1e-6)
+
+
+def test_regions_cover_min_size():
+    for _, region, core in iter_tiles((130, 65), 64, halo=3, min_size=11):
+        assert all(axis.stop - axis.start >= 11 for axis in region)
+        assert all(axis.start >= 0 for axis in core)
+
+
+def test_tiled_abs_diff_matches_untiled():
+    rng = np.random.default_rng(1)
+    img1, img2 = (rng.integers(0, 256, (65, 130, 3), dtype=np.uint8) for _ in range(2))
+    expected = cv2.cvtColor(cv2.absdiff(img1, img2), cv2.COLOR_BGR2GRAY)
+    np.testing.assert_array_equal(tiled_abs_diff(img1, img2, 64), expected)
+
+
+def test_compare_endpoint_with_remainder_tile():
+    gray1, gray2 = noisy_pair((64 + 1, 128 + 2))
+    images = [base64.b64encode(cv2.imencode('.png', cv2.cvtColor(g, cv2.COLOR_GRAY2BGR))[1]).decode()
+              for g in (gray1, gray2)]
+    response = app.test_client().post('/api/compare', json={
+        'image1': images[0], 'image2': images[1], 'tile_size': 64, 'metrics': ['ssim', 'pixel_diff']
+    })
+    assert response.status_code == 200, response.get_json()
@@ -0,0 +1,57 @@
+"""
+Malformed uploads are answered with a JSON 400, not a 500.
+"""
+
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def png_bytes():
+    img = np.random.default_rng(0).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    return cv2.imencode('.png', img)[1].tobytes()
+
+
+@pytest.mark.parametrize('length', ['abc', '1.5', ''])
+def test_non_integer_image1_length(client, length):
+    body = png_bytes() * 2
+    response = client.post('/api/compare', data=body, content_type='application/octet-stream',
+                           headers={'X-Image1-Length': length})
+    assert response.status_code == 400
+    assert 'X-Image1-Length' in response.get_json()['error']
+
+
+def test_non_integer_image1_length_query_arg(client):
+    response = client.post('/api/compare?image1_length=half', data=png_bytes() * 2,
+                           content_type='application/octet-stream')
+    assert response.status_code == 400
+    assert 'X-Image1-Length' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('image1', [123, None, ['abc'], {'data': 'abc'}])
+def test_non_string_json_image(client, image1):
+    image2 = base64.b64encode(png_bytes()).decode()
+    response = client.post('/api/compare', json={'image1': image1, 'image2': image2})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Image data must be a base64 string'
+
+
+def test_non_string_image_in_list(client):
+    response = client.post('/api/compare/batch', json={'images': [base64.b64encode(png_bytes()).decode(), 42]})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Image data must be a base64 string'
+
+
+def test_non_string_corpus_image(client):
+    response = client.post('/api/hash/index', json={'references': [{'name': 'a', 'image': 7}]})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Image data must be a base64 string'
@@ -0,0 +1,124 @@
+"""
+Tiled Execution
+Author: Kevin Hintermaier
+
+Bounded-memory SSIM and pixel difference for very large images
+(e.g. 12k x 9k PCB scans).
+
+Images are processed in tiles with a halo of `radius` pixels so that every
+filter window of the core region sees exactly the pixels it would see on
+the full image; at the image border the halo is clipped and OpenCV's
+reflected border takes over, just like in the untiled code. Scores and
+pixel counts are accumulated exactly over the tile cores, and the 8-bit
+output maps are written tile by tile into a preallocated array (which may
+be an np.memmap). Float working memory is bounded by the tile size.
+"""
+
+import cv2
+import numpy as np
+
+from ssim import _window_filter, ssim_map
+
+DEFAULT_TILE_SIZE = 1024
+
+
+def _span(start, stop, halo, length, min_size):
+    """Region [lo, hi) of a tile along one axis, grown by `halo` and to `min_size`."""
+    lo, hi = max(0, start - halo), min(length, stop + halo)
+    # A narrow last tile reaches further back into the image instead
+    return max(0, min(lo, hi - min_size)), hi
+
+
+def iter_tiles(shape, tile_size, halo=0, min_size=0):
+    """
+    Yield (target, region, core) slice tuples covering an image of `shape`.
+    `target` is the tile in image coordinates, `region` the tile grown by
+    `halo` (clipped to the image) and `core` the tile's position inside
+    the region. Regions are at least `min_size` pixels along each axis
+    (if the image is), e.g. one filter window for a remainder tile only a
+    few pixels wide.
+    """
+    h, w = shape[:2]
+    for y0 in range(0, h, tile_size):
+        y1 = min(y0 + tile_size, h)
+        ry0, ry1 = _span(y0, y1, halo, h, min_size)
+        for x0 in range(0, w, tile_size):
+            x1 = min(x0 + tile_size, w)
+            rx0, rx1 = _span(x0, x1, halo, w, min_size)
+            region = (slice(ry0, ry1), slice(rx0, rx1))
+            core = (slice(y0 - ry0, y1 - ry0), slice(x0 - rx0, x1 - rx0))
+            yield (slice(y0, y1), slice(x0, x1)), region, core
+
+
+def tiled_ssim(gray1, gray2, window='box', tile_size=DEFAULT_TILE_SIZE, out=None, progress=None):
+    """
+    SSIM computed tile by tile. Returns (score, diff) where diff is the
+    uint8 map (ssim * 255) written into `out` (allocated if None).
+    `progress` is called with the fraction of tiles done after each tile.
+
+    The score equals the untiled mean_ssim(): the same border crop is
+    applied and the sum is accumulated in float64 over the tile cores.
+    """
+    if gray1.shape != gray2.shape:
+        raise ValueError('Input images must have the same dimensions')
+    _, win_size = _window_filter(window, 7, 1.5)
+    radius = win_size // 2
+    pad = (win_size - 1) // 2
+    h, w = gray1.shape[:2]
+    if out is None:
+        out = np.empty((h, w), dtype=np.uint8)
+
+    total = 0.0
+    tiles = -(-h // tile_size) * -(-w // tile_size)
+    for index, (target, region, core) in enumerate(iter_tiles(gray1.shape, tile_size, halo=radius, min_size=win_size), 1):
+        values, _ = ssim_map(gray1[region], gray2[region], window)
+        values = values[core]
+        out[target] = (values * 255).astype(np.uint8)
+
+        # Only the part of the core inside the global border crop counts
+        y0, x0 = target[0].start, target[1].start
+        crop = values[max(0, pad - y0):max(0, h - pad - y0), max(0, pad - x0):max(0, w - pad - x0)]
+        if crop.size:
+            total += cv2.sumElems(crop)[0]
+        if progress is not None:
+            progress(index / tiles)
+
+    count = max(0, h - 2 * pad) * max(0, w - 2 * pad)
+    return total / count, out
+
+
+def tiled_abs_diff(img1, img2, tile_size=DEFAULT_TILE_SIZE, out=None):
+    """
+    Grayscale absolute difference computed tile by tile, so the
+    full-size 3-channel difference is never allocated.
+    """
+    if out is None:
+        out = np.empty(img1.shape[:2], dtype=np.uint8)
+    for target, region, _ in iter_tiles(img1.shape, tile_size):
+        diff = cv2.absdiff(img1[region], img2[region])
+        out[target] = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY) if diff.ndim == 3 else diff
+    return out
+
+
+def tiled_diff_stats(diff_gray, threshold, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Exact changed-pixel statistics of a grayscale difference map,
+    accumulated per tile instead of thresholding the whole map at once.
+    """
+    changed_pixels = 0
+    total = 0
+    max_difference = 0
+    for target, _, _ in iter_tiles(diff_gray.shape, tile_size):
+        tile = diff_gray[target]
+        changed_pixels += int(np.count_nonzero(tile > threshold))
+        total += int(cv2.sumElems(tile)[0])
+        max_difference = max(max_difference, int(tile.max()))
+
+    total_pixels = diff_gray.shape[0] * diff_gray.shape[1]
+    return {
+        'difference_percentage': float(changed_pixels / total_pixels * 100),
+        'changed_pixels': changed_pixels,
+        'total_pixels': int(total_pixels),
+        'mean_difference': float(total / total_pixels),
+        'max_difference': max_difference
+    }
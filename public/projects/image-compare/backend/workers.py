@@ -0,0 +1,242 @@
+"""
+Compute Workers
+Author: Kevin Hintermaier
+
+Optional process pool for the CPU-bound part of a comparison. Threads
+only overlap while OpenCV and NumPy release the GIL; the pure Python
+parts of a request (sorting matches, building masks and result dicts)
+serialize across all concurrent requests of one process. In compute
+processes every request runs its stage graph in its own interpreter.
+
+Images cross the process boundary through multiprocessing.shared_memory
+instead of being pickled:
+- the parent copies the decoded inputs into shared memory segments and
+  sends only their (name, shape, dtype) descriptors
+- the worker maps them as read-only arrays, runs the task and writes its
+  output arrays into one result segment the parent allocated up front
+- the parent copies the outputs out and unlinks every segment
+
+Only small values (scores, stats) are pickled. Tasks are registered by
+name with @task in modules the workers import on startup, so the parent
+does not have to be importable under the same module name (e.g. when it
+runs as __main__). Every worker imports these modules, so they should not
+create caches, pools or other state at import time. Note that the spawn
+start method also re-imports a parent that runs as a script (as
+__mp_main__) in every worker, before any of this runs.
+"""
+
+import importlib.util
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# Task name -> func(arrays, *args) returning (value, {name: output array})
+TASKS = {}
+
+# Output arrays start at multiples of this many bytes of the result segment
+ALIGNMENT = 64
+
+
+def task(name):
+    """Register a function as compute task `name`."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def submit_restarting(executor, start, fn, *args):
+    """
+    Submit fn(*args) to a ProcessPoolExecutor. A crashed worker breaks the
+    whole pool; then it is shut down and the call goes to the fresh pool
+    returned by `start()`.
+    """
+    try:
+        return executor.submit(fn, *args)
+    except BrokenProcessPool:
+        executor.shutdown(wait=False)
+        return start().submit(fn, *args)
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _share(array):
+    """Copy an array into a new shared memory segment. Returns (segment, descriptor)."""
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def _close(segments):
+    for segment in segments:
+        try:
+            segment.close()
+        except BufferError:
+            # An array still points into the segment; the mapping goes
+            # away with that array
+            pass
+
+
+# ========================================
+# Worker Side
+# ========================================
+
+def _is_main(module):
+    """True if `module` is the parent's script, already re-imported as __mp_main__."""
+    main = getattr(sys.modules.get('__mp_main__'), '__file__', None)
+    spec = importlib.util.find_spec(module)
+    return main is not None and spec is not None and os.path.samefile(main, spec.origin)
+
+
+def _init_worker(modules, opencv_threads):
+    for module in modules:
+        # Importing the parent's script a second time under its module
+        # name would run its setup twice
+        if not _is_main(module):
+            importlib.import_module(module)
+    # After the imports, which may set their own thread count
+    cv2.setNumThreads(opencv_threads)
+
+
+def _builtin_error(error):
+    """
+    Exceptions travel back pickled by class. Classes of the task modules
+    may not be importable in the parent, so they are mapped to their
+    nearest builtin base class with the same message.
+    """
+    if type(error).__module__ == 'builtins':
+        return error
+    base = next(cls for cls in type(error).__mro__ if cls.__module__ == 'builtins')
+    return base(*error.args)
+
+
+def _attach(descriptor):
+    name, shape, dtype = descriptor
+    segment = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype, buffer=segment.buf)
+    array.flags.writeable = False
+    return segment, array
+
+
+def _write_outputs(outputs, output, limits):
+    """Copy the task's output arrays into the result segment. Returns their layout."""
+    segment = shared_memory.SharedMemory(name=output)
+    try:
+        layout = {}
+        offset = 0
+        for key, array in outputs.items():
+            array = np.ascontiguousarray(array)
+            if key not in limits or array.nbytes > limits[key]:
+                raise RuntimeError(f"Output '{key}' does not fit into the result segment")
+            np.ndarray(array.shape, array.dtype, buffer=segment.buf, offset=offset)[...] = array
+            layout[key] = (offset, array.shape, array.dtype.str)
+            offset += _aligned(limits[key])
+        return layout
+    finally:
+        _close([segment])
+
+
+def _call(name, inputs, output, limits, args):
+    segments = []
+    arrays = {}
+    for key, descriptor in inputs.items():
+        segment, arrays[key] = _attach(descriptor)
+        segments.append(segment)
+    try:
+        value, outputs = TASKS[name](arrays, *args)
+        layout = _write_outputs(outputs, output, limits) if outputs else {}
+        return value, layout
+    finally:
+        # Views of the inputs must be gone before their segments close
+        arrays = outputs = None
+        _close(segments)
+
+
+def _run_task(name, inputs, output, limits, args):
+    """Entry point in the worker process."""
+    try:
+        return _call(name, inputs, output, limits, args)
+    except Exception as e:
+        raise _builtin_error(e) from None
+
+
+# ========================================
+# Pool
+# ========================================
+
+class ComputePool:
+    """
+    Process pool running registered tasks with shared-memory array
+    handoff (started lazily on the first run). Thread-safe.
+    """
+
+    def __init__(self, processes, modules, opencv_threads=1):
+        self.processes = processes
+        self.modules = tuple(modules)
+        self.opencv_threads = opencv_threads
+        self._context = multiprocessing.get_context('spawn')
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(
+            self.processes, mp_context=self._context, initializer=_init_worker,
+            initargs=(self.modules, self.opencv_threads)
+        )
+        return self._executor
+
+    def _submit(self, *args):
+        with self._lock:
+            if self._executor is None:
+                self._start()
+            return submit_restarting(self._executor, self._start, _run_task, *args)
+
+    def run(self, name, arrays, outputs, *args):
+        """
+        Run task `name` on a worker with `arrays` ({name: ndarray}) passed
+        through shared memory. `outputs` maps the names of the output arrays
+        the task may return to their maximum size in bytes.
+        Returns (value, {name: output array}).
+        """
+        segments = []
+        try:
+            inputs = {}
+            for key, array in arrays.items():
+                segment, inputs[key] = _share(array)
+                segments.append(segment)
+            output = None
+            if outputs:
+                size = sum(_aligned(limit) for limit in outputs.values())
+                segments.append(shared_memory.SharedMemory(create=True, size=max(size, 1)))
+                output = segments[-1].name
+
+            value, layout = self._submit(name, inputs, output, dict(outputs), args).result()
+
+            results = {
+                key: np.ndarray(shape, dtype, buffer=segments[-1].buf, offset=offset).copy()
+                for key, (offset, shape, dtype) in layout.items()
+            }
+            return value, results
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+
+    def stats(self):
+        return {'processes': self.processes, 'started': self._executor is not None}
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
@@ -9,6 +9,7 @@
 // Configuration
 // ========================================
 const API_BASE = 'http://localhost:5000/api';
+const BACKEND_ORIGIN = API_BASE.replace(/\/api$/, '');
 
 // ========================================
 // State Management
@@ -592,6 +593,30 @@ async function checkBackendStatus() {
     }
 }
 
+// Upload both images as multipart files instead of base64 JSON:
+// ~25% less upload and no base64 decoding on the backend
+async function buildImageForm() {
+    const [blob1, blob2] = await Promise.all([
+        fetch(state.image1.src).then(res => res.blob()),
+        fetch(state.image2.src).then(res => res.blob())
+    ]);
+    const form = new FormData();
+    form.append('image1', blob1, 'image1');
+    form.append('image2', blob2, 'image2');
+    return form;
+}
+
+// Visualizations are requested as artifact URLs (image_output=url): the JSON
+// only carries scores and the browser fetches the images in parallel.
+// Backends without artifact support ignore the option and answer with
+// inline base64 PNGs, which are shown as data URLs.
+function artifactUrl(value) {
+    if (!value.startsWith('/')) {
+        return `data:image/png;base64,${value}`;
+    }
+    return `${BACKEND_ORIGIN}${value}`;
+}
+
 async function runOpenCVAnalysis() {
     if (!state.image1 || !state.image2) {
         alert('Bitte laden Sie zuerst beide Bilder hoch!');
@@ -610,15 +635,9 @@ async function runOpenCVAnalysis() {
     elements.analyzeBtn.textContent = '⏳ Analysiere...';
 
     try {
-        const response = await fetch(`${API_BASE}/compare`, {
+        const response = await fetch(`${API_BASE}/compare?image_output=url`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                image1: state.image1.src,
-                image2: state.image2.src
-            })
+            body: await buildImageForm()
         });
 
         if (!response.ok) {
@@ -652,7 +671,7 @@ function displayOpenCVResults(results) {
     const ssimScore = results.ssim.score.toFixed(4);
     elements.ssimScore.textContent = ssimScore;
     elements.ssimLabel.textContent = results.ssim.interpretation;
-    elements.ssimDiffImg.src = `data:image/png;base64,${results.ssim.diff_image}`;
+    elements.ssimDiffImg.src = artifactUrl(results.ssim.diff_image);
 
     // Feature Matching Results
     if (results.features.stats) {
@@ -660,12 +679,12 @@ function displayOpenCVResults(results) {
         elements.featuresImg2.textContent = results.features.stats.image2_keypoints;
         elements.featuresMatches.textContent = results.features.stats.total_matches;
     }
-    elements.featureMatchImg.src = `data:image/png;base64,${results.features.visualization}`;
+    elements.featureMatchImg.src = artifactUrl(results.features.visualization);
 
     // Edge Detection Results
     const edgeSim = (results.edges.similarity * 100).toFixed(1);
     elements.edgeSimilarity.textContent = `${edgeSim}%`;
-    elements.edgeDiffImg.src = `data:image/png;base64,${results.edges.diff_image}`;
+    elements.edgeDiffImg.src = artifactUrl(results.edges.diff_image);
 
     // Histogram Results
     elements.histCorrelation.textContent = results.histogram.correlation.toFixed(4);
@@ -674,7 +693,7 @@ function displayOpenCVResults(results) {
     // Pixel Difference Results
     elements.pixelDiffPercent.textContent = `${results.pixel_diff.difference_percentage.toFixed(2)}%`;
     elements.pixelDiffCount.textContent = results.pixel_diff.changed_pixels.toLocaleString();
-    elements.pixelHeatmapImg.src = `data:image/png;base64,${results.pixel_diff.heatmap}`;
+    elements.pixelHeatmapImg.src = artifactUrl(results.pixel_diff.heatmap);
 }
 
 async function runTemplateMatching() {
@@ -693,13 +712,9 @@ async function runTemplateMatching() {
     elements.runTemplateBtn.disabled = true;
 
     try {
-        const response = await fetch(`${API_BASE}/template-match`, {
+        const response = await fetch(`${API_BASE}/template-match?image_output=url`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                image1: state.image1.src, // Source
-                image2: state.image2.src  // Template
-            })
+            body: await buildImageForm() // image1 = Source, image2 = Template
         });
 
         const data = await response.json();
@@ -710,7 +725,7 @@ async function runTemplateMatching() {
             const percentage = (confidence * 100).toFixed(1);
 
             elements.templateConfidence.textContent = `${percentage}%`;
-            elements.templateResultImg.src = `data:image/png;base64,${data.results.visualization}`;
+            elements.templateResultImg.src = artifactUrl(data.results.visualization);
 
             // Update Confidence Bar
             const barFill = document.getElementById('confidence-fill');
@@ -63,6 +63,43 @@ def test_scenario(name, source_file, template_file, expected_confidence=0.8):
         print("❌ Connection Error: Is the backend server running on port 5000?")
         return False
 
+def test_pyramid_equivalence(name, source_file, template_file, tolerance=0.02):
+    """
+    Pyramid search must find the same match as the exhaustive search.
+    Locations must be identical; confidences may differ by OpenCV's float32
+    rounding of TM_CCOEFF_NORMED (up to ~1e-2 on flat UI templates).
+    """
+    print(f"\n--- Pyramid vs. Exhaustive: {name} ---")
+
+    img1 = encode_image(source_file)
+    img2 = encode_image(template_file)
+
+    if not img1 or not img2:
+        return False
+
+    matches = {}
+    for search in ("exhaustive", "pyramid"):
+        try:
+            response = requests.post(API_URL, json={"image1": img1, "image2": img2, "search": search})
+        except requests.exceptions.ConnectionError:
+            print("❌ Connection Error: Is the backend server running on port 5000?")
+            return False
+        if response.status_code != 200 or not response.json().get("success"):
+            print(f"❌ HTTP Error {response.status_code}: {response.text[:100]}")
+            return False
+        matches[search] = response.json()["results"]["match"]
+
+    exhaustive, pyramid = matches["exhaustive"], matches["pyramid"]
+    delta = abs(exhaustive["confidence"] - pyramid["confidence"])
+    print(f"   Exhaustive: {exhaustive['confidence']:.4f} at {exhaustive['location']}")
+    print(f"   Pyramid:    {pyramid['confidence']:.4f} at {pyramid['location']}")
+
+    if exhaustive["location"] == pyramid["location"] and delta <= tolerance:
+        print("   RESULT: PASS")
+        return True
+    print(f"   RESULT: FAIL (location or confidence differs, delta {delta:.4f})")
+    return False
+
 def main():
     print("🔍 Starting API Scenario Verification...")
     
@@ -86,6 +123,16 @@ def main():
     if test_scenario("UI Testing", "example-ui-source.png", "example-ui-template.png"):
         passed += 1
 
+    # Pyramid search must agree with the exhaustive search
+    for name, source_file, template_file in [
+        ("Security CCTV", "example-security-source.png", "example-security-template.png"),
+        ("UI Testing", "example-ui-source.png", "example-ui-template.png"),
+        ("Fishing Scene", "example-fishing-scene.png", "example-fishing-template.png"),
+    ]:
+        total += 1
+        if test_pyramid_equivalence(name, source_file, template_file):
+            passed += 1
+
     print(f"\nSummary: {passed}/{total} Tests Passed")
     
     if passed == total:
@@ -0,0 +1,75 @@
+"""
+check_import_time.py - Cold-start budget of the Flask backend
+Imports backend/app.py in fresh interpreters and fails (exit code 1) when
+
+- the median import time exceeds the budget, or
+- importing the app (or preloading a chat-only deployment) loads a heavy
+  module that only the first request needing it should load.
+
+Usage:
+    python scripts/check_import_time.py [--budget-ms 500] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+# Modules that must stay out of a cold start
+HEAVY_MODULES = ("cv2", "numpy", "skimage", "requests")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+if "--preload" in sys.argv:
+    app.preload()
+print(json.dumps({
+    "ms": elapsed * 1000,
+    "loaded": [name for name in %r if name in sys.modules]
+}))
+""" % (HEAVY_MODULES,)
+
+
+def probe(features, preload=False):
+    env = dict(os.environ, BACKEND_FEATURES=features)
+    args = [sys.executable, "-c", PROBE] + (["--preload"] if preload else [])
+    output = subprocess.run(args, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=500, help="maximum median import time")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to measure")
+    args = parser.parse_args()
+
+    failures = []
+    runs = [probe("chat,vision") for _ in range(args.runs)]
+    median = statistics.median(run["ms"] for run in runs)
+    print(f"import app: median {median:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    if median > args.budget_ms:
+        failures.append(f"import time {median:.0f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    if loaded:
+        failures.append(f"import app loads {', '.join(loaded)}")
+
+    chat_only = probe("chat", preload=True)["loaded"]
+    if chat_only:
+        failures.append(f"chat-only preload loads {', '.join(chat_only)}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Cold start within budget, no heavy modules loaded")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,12 @@
 #!/bin/bash
+# Usage: ./start-all.sh [--production]
+#   --production  serve the backend with gunicorn (backend/gunicorn.conf.py)
+#                 instead of the Flask development server
+
+MODE=development
+if [ "$1" = "--production" ]; then
+  MODE=production
+fi
 
 echo "🚀 Starting Portfolio Website..."
 echo "================================"
@@ -10,16 +18,23 @@ source venv/bin/activate 2>/dev/null || echo "⚠️  venv not found, creating..
 python -m venv venv 2>/dev/null
 source venv/bin/activate
 pip install -q -r requirements.txt
-python app.py &
+if [ "$MODE" = "production" ]; then
+  gunicorn -c gunicorn.conf.py app:app &
+else
+  python app.py &
+fi
 BACKEND_PID=$!
 cd ..
 
-# Wait for backend to start
-echo "⏳ Waiting for backend to start..."
-sleep 3
+# Wait for backend to start (workers warm up before serving)
+echo "⏳ Waiting for backend to start ($MODE)..."
+for _ in $(seq 30); do
+  curl -s http://localhost:5000/api/health > /dev/null && break
+  sleep 1
+done
 
 # Check backend health
-if curl -s http://localhost:5000/health > /dev/null; then
+if curl -s http://localhost:5000/api/health > /dev/null; then
   echo "✅ Backend started successfully"
 else
   echo "❌ Backend failed to start"